@@ -0,0 +1,154 @@
+from typing import Dict, List
+
+import math
+import os
+import queue
+import time
+import torch
+import torch.multiprocessing as mp
+from vecenv import VecEnvs
+from model import ActorCritic
+from reversi import SIZE
+from symmetry import SYMMETRIES
+from main import GAMMA, EPISODES, SAVE_INTERVAL, NUM_WORKERS, BATCH_SIZE, AUGMENT, REPLY_CACHE, augment, rollout, trainBatch, save
+import replycache
+
+# 异步训练：多个 actor 进程各自持有一份网络和一组棋盘，不停地采集对局，
+# 把轨迹放进有界队列；learner 进程不断从队列取轨迹训练，定期把新参数发布到共享内存
+# actor 每采集完一回合检查参数版本，有新版本就复制过来
+# 每条轨迹记录采集时的参数版本，落后 learner 超过 MAX_LAG 个已发布版本的轨迹直接丢弃
+# 默认 learner 每训练 actor 数那么多条轨迹发布一次，一个 actor 采集一回合的时间内版本大约前进 1，
+# 再加上在队列中等待的 QUEUE_SIZE 条轨迹，默认的 MAX_LAG 按这两部分计算，正常情况下不丢弃轨迹
+# 队列满时 actor 阻塞等待，保证 learner 跟不上时不会无限堆积旧数据
+# 用法：python actors.py
+
+NUM_ACTORS = max((os.cpu_count() or 2) - 1, 1) # learner 占用一个核
+BOARDS_PER_ACTOR = max(NUM_WORKERS // NUM_ACTORS, 2)
+QUEUE_SIZE = 8 # 队列中最多的轨迹数
+SYNC_INTERVAL = None # learner 每训练这么多条轨迹发布一次参数，None 表示等于 actor 数
+MAX_LAG = None # 允许轨迹落后的已发布版本数，None 表示 1 + ceil((actor 数 + QUEUE_SIZE) / SYNC_INTERVAL)
+
+# 共享的参数：state_dict 的每个张量都放在共享内存中，version 为已发布的版本号
+class SharedWeights:
+    def __init__(self, net: ActorCritic):
+        self.tensors = {k: v.detach().cpu().clone().share_memory_() for k, v in net.state_dict().items()}
+        self.version = mp.Value('i', 0)
+        self.lock = mp.Lock()
+
+    def publish(self, net: ActorCritic):
+        with self.lock:
+            for k, v in net.state_dict().items():
+                self.tensors[k].copy_(v)
+            self.version.value += 1
+
+    # 版本比 version 新时复制到 net，返回当前的版本号
+    def pull(self, net: ActorCritic, version: int) -> int:
+        with self.lock:
+            latest = self.version.value
+            if latest != version:
+                net.load_state_dict(self.tensors)
+        return latest
+
+def actor(rank: int, weights: SharedWeights, trajectories: mp.Queue, stop: mp.Event):
+    torch.set_num_threads(1)
+    torch.manual_seed(rank)
+    net = ActorCritic()
+    envs = VecEnvs(BOARDS_PER_ACTOR, gamma=GAMMA, num_processes=0) # Minimax 对手在本进程中搜索
+    version = -1
+
+    while not stop.is_set():
+        version = weights.pull(net, version)
+        history = rollout(net, envs, torch.device('cpu'))
+        if not history:
+            continue
+        trajectory = (
+            torch.stack([s for s, _, _, _, _ in history]).to(torch.uint8),
+            torch.tensor([y * SIZE + x for _, (y, x), _, _, _ in history]),
+            torch.tensor([R for _, _, R, _, _ in history]),
+            version,
+        )
+        # 队列满时等待，同时检查是否该结束
+        while not stop.is_set():
+            try:
+                trajectories.put(trajectory, timeout=1)
+                break
+            except queue.Full:
+                pass
+
+def learn(episodes: int = EPISODES, num_actors: int = NUM_ACTORS):
+    interval = SYNC_INTERVAL if SYNC_INTERVAL is not None else num_actors
+    maxLag = MAX_LAG if MAX_LAG is not None else 1 + math.ceil((num_actors + QUEUE_SIZE) / interval)
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    net = ActorCritic().to(device)
+    optimizer = torch.optim.Adam(net.parameters(), lr=3e-4)
+
+    # actor 共用一张应对缓存，要在启动 actor 之前打开
+    if REPLY_CACHE is not None:
+        replycache.enable(REPLY_CACHE)
+
+    weights = SharedWeights(net)
+    trajectories = mp.Queue(QUEUE_SIZE)
+    stop = mp.Event()
+    processes = [mp.Process(target=actor, args=(rank, weights, trajectories, stop), daemon=True) for rank in range(num_actors)]
+    for process in processes:
+        process.start()
+
+    samples = max(BATCH_SIZE // SYMMETRIES, 1) if AUGMENT == 'all' else BATCH_SIZE
+    stats: Dict[str, int] = {'samples': 0, 'received': 0, 'dropped': 0}
+    start = time.perf_counter()
+    version = 0
+    episode = 0
+    while episode < episodes:
+        states, actions, Returns, behaviour = trajectories.get()
+        stats['received'] += 1
+        lag = version - behaviour
+        if lag > maxLag:
+            stats['dropped'] += 1
+            continue
+
+        # 与 main.py 一样，把一条轨迹打乱后按 batch 训练
+        net.train()
+        value_losses: List[float] = []
+        entropies: List[float] = []
+        for idx in torch.randperm(len(states)).split(samples):
+            value_loss, entropy, _ = trainBatch(net, optimizer, device, *augment(states[idx], actions[idx], Returns[idx]))
+            value_losses.append(value_loss)
+            entropies.append(entropy)
+
+        stats['samples'] += len(states)
+        episode += 1
+        if episode % interval == 0:
+            weights.publish(net)
+            version += 1
+
+        elapsed = time.perf_counter() - start
+        print('Episode: {:>10d}, Value Loss: {:g}, Entropy: {:g}, Lag: {}/{}, Dropped: {:.1%}, Samples/s: {:.1f}, Queue: {}'.format(
+            episode,
+            sum(value_losses) / len(value_losses),
+            sum(entropies) / len(entropies),
+            lag,
+            maxLag,
+            stats['dropped'] / stats['received'],
+            stats['samples'] / elapsed,
+            trajectories.qsize(),
+            ), flush=True)
+
+        if episode % SAVE_INTERVAL == 0:
+            save(net, episode // SAVE_INTERVAL)
+
+    # 通知 actor 不再放入轨迹，一边取空队列一边等待它们退出：
+    # actor 的后台线程要把已放入的轨迹写完才能退出，队列不取空时 join 会一直等下去
+    # 发送方已经退出的轨迹无法再取得共享内存，会抛出 EOFError 或 OSError，直接丢弃
+    stop.set()
+    while processes:
+        try:
+            while True:
+                trajectories.get_nowait()
+        except (queue.Empty, EOFError, OSError):
+            pass
+        for process in processes:
+            process.join(timeout=0.1)
+        processes = [process for process in processes if process.is_alive()]
+
+if __name__ == '__main__':
+    learn()
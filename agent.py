@@ -1,29 +1,56 @@
+from typing import Optional
+
 import torch
 from torch.distributions.categorical import Categorical
 from reversi import Coordinate, Reversi, SIZE
-from model import ActorCritic
-from env import getBoardState
-import itertools
+from model import loadNet
+from env import encodeBoardState
+from vecenv import batchPlanes, toSigned
+from endgame import EMPTIES, solvable, solveMove
+from book import BOOK_PATH, probe
+import inference
+
+MODEL_PATH = 'models/good.pt'
+BACKEND = 'eager' # 'eager'：直接使用 float 模型；'compiled'：使用量化并冻结的模型（见 inference.py）
 
 class Agent:
-    def __init__(self):
-        self.net = ActorCritic()
-        self.net.load_state_dict(torch.load('models/good.pt', map_location='cpu'))
-        self.net.eval()
-        torch.no_grad().__enter__() # 关闭梯度记录
+    # 开局库 book 中有当前局面时直接使用，空格数不超过 endgame 时直接精确求解，都为 None 时总是使用网络
+    def __init__(self, endgame: Optional[int] = EMPTIES, book: Optional[str] = BOOK_PATH, path: str = MODEL_PATH,
+        backend: str = BACKEND):
+
+        self.endgame = endgame
+        self.book = book
+        if backend == 'compiled':
+            self.net = inference.load(path)
+        elif backend == 'eager':
+            self.net = loadNet(path) # ActorCritic 或蒸馏得到的 Student
+            self.net.eval()
+        else:
+            raise Exception('Unknown backend: {}'.format(backend))
+        self.state = torch.empty(1, 3, SIZE, SIZE) # 每次走棋复用的输入张量
     
     def brain(self, reversi: Reversi, who: int) -> Coordinate:
         # assert reversi.next == who
-        state = torch.Tensor(getBoardState(reversi)).unsqueeze(0)
-        policy = self.net(state)[1][0]
+        if self.book is not None:
+            position = probe(reversi, self.book)
+            if position is not None:
+                return position
+
+        if self.endgame is not None and solvable(reversi, self.endgame):
+            position, _ = solveMove(reversi)
+            return position
+
+        return self.think(reversi, who)
+
+    # 用网络选择走法，子类（如 mcts.MCTSAgent）可以替换
+    def think(self, reversi: Reversi, who: int) -> Coordinate:
+        with torch.no_grad():
+            policy = self.net(encodeBoardState(reversi, self.state[0]).unsqueeze(0))[1][0]
 
         # 保证位置合法性
-        for y, x in itertools.product(range(SIZE), repeat=2):
-            if not reversi.good[y][x]:
-                policy[y * SIZE + x] = 0.
-            else:
-                policy[y * SIZE + x] += 1e-8 # 防止概率全为 0
-        
+        legal = batchPlanes(torch.tensor([toSigned(reversi.moves)])).view(-1).bool()
+        policy = torch.where(legal, policy + 1e-8, 0.) # 防止概率全为 0
+
         action = policy.max(dim=-1).indices.item()
         return (action // SIZE, action % SIZE)
         
\ No newline at end of file
@@ -0,0 +1,281 @@
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from reversi import Reversi, SIZE
+
+# 基准测试：
+#   perft    从初始局面出发的走法树叶子数，检查走法生成是否正确，以及最深一层的速度
+#   minimax  固定局面集上固定深度搜索的节点数、节点/秒和选出的走法
+#   parallel 同样的局面上根节点分割的并行搜索相对单进程搜索的加速比，以及选出的走法是否一致
+#   envs     Envs / VecEnvs 在不同棋盘数下每秒的智能体步数
+#   network  ActorCritic 在不同 batch 大小下的前向延迟和吞吐量
+# 结果写入 JSON，并与保存的基准结果比较：计数和走法必须完全一致，速度低于基准 TOLERANCE 以上视为退化
+
+OUTPUT = 'bench.json'
+BASELINE = 'bench_baseline.json'
+TOLERANCE = 0.1
+
+PERFT_DEPTH = 7
+# 初始局面的 perft 结果（第 9 步起才可能出现终局，这里都不涉及）
+PERFT_KNOWN = [1, 4, 12, 56, 244, 1396, 8200, 55092, 390216]
+MINIMAX_DEPTHS = [2, 3, 4]
+MINIMAX_POSITIONS = 8 # 随机走 10 ~ 45 步得到的固定局面
+ENVS_WORKERS = [2, 8, 32]
+PARALLEL_DEPTH = 5
+PARALLEL_WORKERS = [2, 4]
+NETWORK_BATCHES = [1, 16, 64, 256]
+NETWORK_REPEAT = 20
+REPEAT = 3 # perft 和 minimax 重复测量的次数，取最快的一次，减少计时噪声
+
+SECTIONS = ['perft', 'minimax', 'parallel', 'envs', 'network']
+
+# 计算走 depth 步的叶子数，使用 Reversi 的 place/unplace，自动跳过的回合不计步数
+def perft(reversi: Reversi, depth: int) -> int:
+    if depth == 0 or reversi.next == 0:
+        return 1
+    moves = reversi.moves
+    if depth == 1:
+        return moves.bit_count()
+    who = reversi.next
+    count = 0
+    while moves:
+        move = moves & -moves
+        moves ^= move
+        reversi.place(divmod(move.bit_length() - 1, SIZE), who)
+        count += perft(reversi, depth - 1)
+        reversi.unplace()
+    return count
+
+# 重复运行 fn，返回：(结果, 最快一次的用时)
+def timed(fn: Callable[[], Any], repeat: int = REPEAT) -> Tuple[Any, float]:
+    best = float('inf')
+    for _ in range(repeat):
+        t = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - t)
+    return result, best
+
+# 每一层都检查叶子数，只有最深一层计算速度：浅层只用几微秒到几毫秒，计时噪声远大于 TOLERANCE
+def benchPerft(depth: int = PERFT_DEPTH) -> Dict[str, dict]:
+    results = {}
+    for d in range(1, depth + 1):
+        nodes, seconds = timed(lambda: perft(Reversi(), d))
+        results[str(d)] = {'nodes': nodes, 'seconds': seconds}
+    deepest = results[str(depth)]
+    deepest['nodes_per_second'] = deepest['nodes'] / max(deepest['seconds'], 1e-9)
+    return results
+
+# perft 与已知结果不一致说明走法生成的规则变了，不依赖基准
+def checkPerft(results: dict) -> List[str]:
+    problems = []
+    for key, entry in results.get('perft', {}).items():
+        d = int(key)
+        if d < len(PERFT_KNOWN) and entry['nodes'] != PERFT_KNOWN[d]:
+            problems.append('perft({}) = {}, expected {}'.format(d, entry['nodes'], PERFT_KNOWN[d]))
+    return problems
+
+# 固定随机种子生成的局面集，元素为 (黑棋, 白棋, 轮到谁)
+def makePositions(count: int = MINIMAX_POSITIONS, seed: int = 0) -> List[tuple]:
+    rnd = random.Random(seed)
+    positions = []
+    while len(positions) < count:
+        reversi = Reversi()
+        plies = 10 + len(positions) * 35 // max(count - 1, 1)
+        for _ in range(plies):
+            if reversi.next == 0:
+                break
+            moves = reversi.moves
+            squares = [square for square in range(SIZE * SIZE) if moves >> square & 1]
+            reversi.place(divmod(rnd.choice(squares), SIZE), reversi.next)
+        if reversi.next != 0:
+            positions.append((reversi.bitboards[1], reversi.bitboards[2], reversi.next))
+    return positions
+
+def benchMinimax(depths: List[int] = MINIMAX_DEPTHS) -> Dict[str, dict]:
+    from minimax import Agent as Minimax
+
+    positions = makePositions()
+
+    def searchAll(depth: int) -> Tuple[int, List[int]]:
+        nodes = 0
+        moves = []
+        for black, white, next in positions:
+            # 每个局面都从空的置换表和走法排序信息开始，保证结果可重复
+            Minimax.reset()
+            reversi = Reversi()
+            reversi.load(black, white, next)
+            y, x = Minimax.brain(reversi, next, endgame=None, book=None, depth=depth)
+            nodes += Minimax.nodes
+            moves.append(y * SIZE + x)
+        return nodes, moves
+
+    results = {}
+    for depth in depths:
+        (nodes, moves), seconds = timed(lambda: searchAll(depth))
+        results[str(depth)] = {'nodes': nodes, 'moves': moves, 'seconds': seconds, 'nodes_per_second': nodes / seconds}
+    return results
+
+def benchParallel(depth: int = PARALLEL_DEPTH, workers: List[int] = PARALLEL_WORKERS) -> Dict[str, dict]:
+    import minimax
+    from minimax import Agent as Minimax
+
+    positions = makePositions()
+
+    # 单进程搜索每个局面都从空的置换表开始；并行搜索不清空，各进程带着之前局面的置换表，
+    # 选出的走法仍应与单进程相同（见 minimax.Agent.split）
+    def searchAll(n: int) -> Tuple[List[int], float]:
+        moves = []
+        seconds = 0.
+        for black, white, next in positions:
+            if n == 1:
+                Minimax.reset()
+            reversi = Reversi()
+            reversi.load(black, white, next)
+            t = time.perf_counter()
+            y, x = Minimax.brain(reversi, next, endgame=None, book=None, depth=depth, workers=n)
+            seconds += time.perf_counter() - t
+            moves.append(y * SIZE + x)
+        return moves, seconds
+
+    serial, serialSeconds = searchAll(1)
+    results = {}
+    for n in workers:
+        minimax.getPool(n) # 创建进程池不计入用时
+        moves, seconds = searchAll(n)
+        results[str(n)] = {
+            'moves': moves,
+            'agreement': sum(a == b for a, b in zip(moves, serial)) / len(serial),
+            'seconds': seconds,
+            'serial_seconds': serialSeconds,
+            'speedup': serialSeconds / seconds,
+            'positions_per_second': len(positions) / seconds,
+        }
+    minimax.closePools()
+    return results
+
+# 智能体随机走棋跑完一回合，返回智能体走的总步数
+def runEpisode(envs) -> int:
+    import torch
+    from vecenv import batchLegal, toSigned
+
+    envs.reset()
+    steps = 0
+    done = False
+    while not done:
+        if hasattr(envs, 'legal'):
+            legal = envs.legal(ended=True)
+        else:
+            black = torch.tensor([toSigned(r.bitboards[1]) for r in envs.reversis])
+            white = torch.tensor([toSigned(r.bitboards[2]) for r in envs.reversis])
+            next = torch.tensor([0 if end else r.next for r, end in zip(envs.reversis, envs.end)])
+            legal = batchLegal(black, white, next) | torch.tensor(envs.end).view(-1, 1)
+        steps += int((~legal.all(dim=-1)).sum()) # 未结束的棋盘不可能所有格子都能下
+        actions = torch.multinomial(legal.float(), 1).view(-1)
+        done, _ = envs.step(actions.tolist())
+    return steps
+
+def benchEnvs(workers: List[int] = ENVS_WORKERS) -> Dict[str, dict]:
+    import torch
+    from env import Envs
+    from vecenv import VecEnvs
+
+    torch.manual_seed(0)
+    results = {}
+    for name, cls in (('Envs', Envs), ('VecEnvs', VecEnvs)):
+        for n in workers:
+            envs = cls(n, gamma=0.9)
+            t = time.perf_counter()
+            steps = runEpisode(envs)
+            seconds = time.perf_counter() - t
+            envs.pool.terminate()
+            results['{}/{}'.format(name, n)] = {'steps': steps, 'seconds': seconds, 'steps_per_second': steps / seconds}
+    return results
+
+def benchNetwork(batches: List[int] = NETWORK_BATCHES, repeat: int = NETWORK_REPEAT) -> Dict[str, dict]:
+    import torch
+    from model import ActorCritic
+
+    net = ActorCritic()
+    net.eval()
+    results = {}
+    with torch.no_grad():
+        for batch in batches:
+            states = torch.randint(0, 2, (batch, 3, SIZE, SIZE)).float()
+            net(states) # 预热
+            t = time.perf_counter()
+            for _ in range(repeat):
+                net(states)
+            seconds = (time.perf_counter() - t) / repeat
+            results[str(batch)] = {'latency_ms': seconds * 1000, 'positions_per_second': batch / seconds}
+    return results
+
+BENCHMARKS = {'perft': benchPerft, 'minimax': benchMinimax, 'parallel': benchParallel, 'envs': benchEnvs, 'network': benchNetwork}
+# 必须与基准完全一致的字段，以及越大越好的速度字段（网络延迟通过吞吐量比较）
+EXACT_FIELDS = ['nodes', 'moves']
+SPEED_FIELDS = ['nodes_per_second', 'steps_per_second', 'positions_per_second']
+
+# 与基准比较，返回发现的问题
+def compare(results: dict, baseline: dict, tolerance: float = TOLERANCE) -> List[str]:
+    problems = []
+    for section, entries in results.items():
+        for key, entry in entries.items():
+            old = baseline.get(section, {}).get(key)
+            if old is None:
+                continue
+            for field in EXACT_FIELDS:
+                if field in entry and field in old and entry[field] != old[field]:
+                    problems.append('{} {} {} changed: {} -> {}'.format(section, key, field, old[field], entry[field]))
+            for field in SPEED_FIELDS:
+                if field in entry and field in old:
+                    ratio = entry[field] / old[field]
+                    mark = ' (regression)' if ratio < 1 - tolerance else ''
+                    print('{:>8} {:>12} {:>22}: {:12.1f} vs {:12.1f}  x{:.2f}{}'.format(
+                        section, key, field, entry[field], old[field], ratio, mark))
+                    if mark:
+                        problems.append('{} {} {} regressed to x{:.2f}'.format(section, key, field, ratio))
+    return problems
+
+def run(sections: List[str]) -> dict:
+    results = {}
+    for section in sections:
+        t = time.perf_counter()
+        results[section] = BENCHMARKS[section]()
+        print('{} finished in {:g} seconds'.format(section, time.perf_counter() - t), flush=True)
+    return results
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Reversi benchmarks')
+    parser.add_argument('sections', nargs='*', help='要运行的部分：{}，默认全部'.format(', '.join(SECTIONS)))
+    parser.add_argument('--output', default=OUTPUT)
+    parser.add_argument('--baseline', default=BASELINE)
+    parser.add_argument('--save-baseline', action='store_true', help='把本次结果保存为基准')
+    args = parser.parse_args(argv)
+    for section in args.sections:
+        if section not in BENCHMARKS:
+            parser.error('unknown section: {}'.format(section))
+
+    results = run(args.sections or SECTIONS)
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+
+    problems = checkPerft(results)
+    if args.save_baseline:
+        if not problems: # 走法生成有误时不保存基准
+            with open(args.baseline, 'w') as f:
+                json.dump(results, f, indent=2)
+    elif not os.path.exists(args.baseline):
+        print('No baseline at {}, run with --save-baseline to create one'.format(args.baseline))
+    else:
+        with open(args.baseline) as f:
+            problems += compare(results, json.load(f))
+    for problem in problems:
+        print(problem, file=sys.stderr)
+    return 1 if problems else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,156 @@
+from typing import Dict, List, Optional, Tuple
+
+from multiprocessing import Pool
+import mmap
+import os
+import struct
+from reversi import Reversi, Coordinate, SIZE
+from symmetry import SOURCES, TARGETS, SYMMETRIES
+
+# 开局库：离线从初始局面出发，对前 BOOK_PLIES 步内所有可能出现的局面做深度搜索，记录最佳走法
+# 8 种对称的局面只存一份（取位棋盘最小的那个作为规范形式），记录按 (黑棋, 白棋, 轮到谁) 排序后
+# 以定长二进制记录写入文件，使用时内存映射并二分查找
+# 文件头：魔数、记录数；每条记录：黑棋位棋盘、白棋位棋盘、轮到谁、最佳走法（规范形式下的格子编号）、分数
+
+BOOK_PATH = 'models/book.bin'
+BOOK_PLIES = 8 # 收录已走 0 ~ BOOK_PLIES - 1 步的局面
+BOOK_DEPTH = 8 # 建库时的搜索深度
+
+MAGIC = b'RVBOOK01'
+HEADER_FORMAT = '<8sq'
+HEADER = struct.calcsize(HEADER_FORMAT)
+RECORD_FORMAT = '<QQBBh'
+RECORD = struct.calcsize(RECORD_FORMAT)
+
+# TRANSFORM[k][j][v]：位棋盘第 j 个字节为 v 时，经过对称变换 k 后对应的位
+TRANSFORM = [[[sum(1 << TARGETS[k][j * 8 + b] for b in range(8) if v >> b & 1) for v in range(256)]
+    for j in range(SIZE * SIZE // 8)] for k in range(SYMMETRIES)]
+
+def transform(bits: int, k: int) -> int:
+    table = TRANSFORM[k]
+    result = 0
+    for j in range(SIZE * SIZE // 8):
+        result |= table[j][bits >> (j * 8) & 0xFF]
+    return result
+
+# 规范形式：8 种对称中 (黑棋, 白棋) 最小的一种，返回：(黑棋, 白棋, 使用的变换编号)
+def canonical(black: int, white: int) -> Tuple[int, int, int]:
+    best = (black, white, 0)
+    for k in range(1, SYMMETRIES):
+        candidate = (transform(black, k), transform(white, k), k)
+        if candidate < best:
+            best = candidate
+    return best
+
+class Book:
+    def __init__(self, path: str = BOOK_PATH):
+        self.file = open(path, 'rb')
+        self.mmap = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.count = struct.unpack_from(HEADER_FORMAT, self.mmap)
+        if magic != MAGIC:
+            raise Exception('{} is not an opening book'.format(path))
+
+    def __len__(self) -> int:
+        return self.count
+
+    # 二分查找规范形式的局面，返回：(最佳走法的格子编号, 分数)，找不到时返回 None
+    def find(self, black: int, white: int, next: int) -> Optional[Tuple[int, int]]:
+        key = (black, white, next)
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            b, w, n, square, score = struct.unpack_from(RECORD_FORMAT, self.mmap, HEADER + mid * RECORD)
+            if (b, w, n) < key:
+                lo = mid + 1
+            elif (b, w, n) > key:
+                hi = mid
+            else:
+                return square, score
+        return None
+
+    # 查找当前局面的开局走法，找不到时返回 None
+    def lookup(self, reversi: Reversi) -> Optional[Coordinate]:
+        if reversi.next == 0:
+            return None
+        black, white, k = canonical(reversi.bitboards[1], reversi.bitboards[2])
+        found = self.find(black, white, reversi.next)
+        if found is None:
+            return None
+        square = SOURCES[k][found[0]] # 变换回原来的方向
+        if not reversi.moves >> square & 1:
+            return None
+        return divmod(square, SIZE)
+
+    def close(self):
+        self.mmap.close()
+        self.file.close()
+
+books: Dict[str, Optional[Book]] = {} # 每个进程各自打开的开局库，文件不存在时为 None
+
+# 在 path 的开局库中查找当前局面，开局库不存在时返回 None
+def probe(reversi: Reversi, path: str = BOOK_PATH) -> Optional[Coordinate]:
+    if path not in books:
+        books[path] = Book(path) if os.path.exists(path) else None
+    book = books[path]
+    return book.lookup(reversi) if book is not None else None
+
+# 列出前 plies 步内可能出现的所有局面（规范形式，去重），元素为 (黑棋, 白棋, 轮到谁)
+def expand(plies: int) -> List[Tuple[int, int, int]]:
+    positions = []
+    seen = set()
+    frontier = [Reversi()]
+    for _ in range(plies):
+        children = []
+        for reversi in frontier:
+            black, white, _ = canonical(reversi.bitboards[1], reversi.bitboards[2])
+            key = (black, white, reversi.next)
+            if reversi.next == 0 or key in seen:
+                continue
+            seen.add(key)
+            positions.append(key)
+
+            moves = reversi.moves
+            while moves:
+                move = moves & -moves
+                moves ^= move
+                child = Reversi()
+                child.load(reversi.bitboards[1], reversi.bitboards[2], reversi.next)
+                child.place(divmod(move.bit_length() - 1, SIZE), reversi.next)
+                children.append(child)
+        frontier = children
+    return positions
+
+# 进程池中对一个规范形式的局面做搜索，返回：(黑棋, 白棋, 轮到谁, 最佳走法, 分数)
+def searchPosition(arg: Tuple[int, int, int, int]) -> Tuple[int, int, int, int, int]:
+    from minimax import Agent as Minimax, INFINITY # minimax 本身会查开局库，在这里才导入
+
+    black, white, next, depth = arg
+    reversi = Reversi()
+    reversi.load(black, white, next)
+    position, score = Minimax.search(reversi, next, -INFINITY, INFINITY, depth)
+    if position is None: # 所有走法都一样差
+        position = Minimax.order(reversi, next, 0, None)[0]
+    return black, white, next, position[0] * SIZE + position[1], max(-32768, min(32767, score))
+
+# 建立开局库并写入 path
+def build(path: str = BOOK_PATH, plies: int = BOOK_PLIES, depth: int = BOOK_DEPTH, num_processes: Optional[int] = None) -> int:
+    positions = expand(plies)
+    with Pool(num_processes) as pool:
+        records = pool.map(searchPosition, [(b, w, n, depth) for b, w, n in positions], chunksize=1)
+    records.sort()
+
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+    with open(path, 'wb') as f:
+        f.write(struct.pack(HEADER_FORMAT, MAGIC, len(records)))
+        for record in records:
+            f.write(struct.pack(RECORD_FORMAT, *record))
+    books.pop(path, None)
+    return len(records)
+
+if __name__ == '__main__':
+    import time
+    t = time.time()
+    count = build()
+    print('{} positions written to {} in {:g} seconds'.format(count, BOOK_PATH, time.time() - t))
@@ -0,0 +1,169 @@
+from typing import Dict, List, Tuple
+
+import os
+import sys
+import time
+import torch
+import torch.nn.functional as F
+from torch.distributions.categorical import Categorical
+from reversi import Reversi, SIZE
+from model import Student, loadNet
+from vecenv import VecEnvs, batchLegal, toUnsigned
+from agent import Agent, MODEL_PATH
+from main import SYMMETRY_SOURCES
+from mcts import VALUE_SCALE
+from symmetry import SYMMETRIES
+
+# 蒸馏：教师网络（models/good.pt）自我对弈得到局面，记录教师在每个局面上的策略和估值，
+# 训练一个小的 Student 网络拟合它们：策略用 KL 散度，估值用均方误差
+# 训练时对每个样本随机做一种对称变换，策略的 64 个格子按同样的变换重排
+# 训练完成后与教师比较：留出局面上的走法一致率、互相对局及对 Minimax 的 Elo、每步的用时
+# Student 的检查点与 ActorCritic 一样由 agent.Agent 载入（见 model.loadNet）
+# 用法：python distill.py [教师检查点] [学生检查点]
+
+TEACHER_PATH = MODEL_PATH
+STUDENT_PATH = 'models/student.pt'
+POSITIONS = 200_000 # 训练局面数
+HELD_OUT = 2_000 # 留出的局面数，用于计算一致率和用时
+BOARDS = 256 # 自我对弈同时进行的棋盘数
+EPSILON = 0.1 # 自我对弈时按这个比例混入均匀随机的走法，让局面更多样
+EPOCHS = 10
+BATCH_SIZE = 256
+LR = 1e-3
+VALUE_LOSS_COEF = 0.5
+GAMES = 40 # 评估棋力时每对棋手的对局数
+LATENCY_MOVES = 200 # 测量每步用时的局面数
+
+# 教师自我对弈，返回：(uint8 状态, 教师估值, 教师策略, (黑棋, 白棋, 轮到谁))
+def selfPlay(teacher: torch.nn.Module, count: int, boards: int = BOARDS) -> Tuple[torch.Tensor, ...]:
+    envs = VecEnvs(boards, gamma=0.9, num_processes=0)
+    states: List[torch.Tensor] = []
+    values: List[torch.Tensor] = []
+    policys: List[torch.Tensor] = []
+    positions: List[torch.Tensor] = []
+    total = 0
+    teacher.eval()
+    with torch.no_grad():
+        while total < count:
+            envs.reset()
+            while not envs.end.all():
+                active = ~envs.end
+                s = envs.states()[active]
+                v, p = teacher(s)
+                states.append(s.to(torch.uint8))
+                values.append(v.view(-1))
+                policys.append(p)
+                positions.append(torch.stack([envs.black, envs.white, envs.next], dim=1)[active])
+                total += len(s)
+
+                legal = envs.legal()[active]
+                probs = torch.where(legal, (1 - EPSILON) * p + EPSILON / legal.sum(dim=-1, keepdim=True), 0.)
+                actions = torch.zeros(boards, dtype=torch.int64)
+                actions[active] = Categorical(probs=probs).sample()
+                envs.play(actions, active)
+
+    # 打乱后截取，避免训练集和留出集来自不同的对局阶段
+    idx = torch.randperm(total)[:count]
+    return torch.cat(states)[idx], torch.cat(values)[idx], torch.cat(policys)[idx], torch.cat(positions)[idx]
+
+# 对一个 batch 随机做对称变换，状态和策略的格子用同一个 gather
+def augment(states: torch.Tensor, policys: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+    index = SYMMETRY_SOURCES[torch.randint(SYMMETRIES, (len(states),))]
+    flat = states.view(len(states), 3, SIZE * SIZE)
+    states = torch.gather(flat, 2, index.unsqueeze(1).expand(-1, 3, -1)).view(-1, 3, SIZE, SIZE).float()
+    return states, torch.gather(policys, 1, index)
+
+def train(student: Student, states: torch.Tensor, values: torch.Tensor, policys: torch.Tensor,
+    epochs: int = EPOCHS, batch_size: int = BATCH_SIZE):
+
+    optimizer = torch.optim.Adam(student.parameters(), lr=LR)
+    for epoch in range(epochs):
+        student.train()
+        policy_total = value_total = 0.
+        batches = 0
+        for idx in torch.randperm(len(states)).split(batch_size):
+            s, target = augment(states[idx], policys[idx])
+            value, policy = student(s)
+            policy_loss = (target * (torch.log(target + 1e-8) - torch.log(policy + 1e-8))).sum(dim=-1).mean()
+            value_loss = F.mse_loss(value.view(-1) / VALUE_SCALE, values[idx] / VALUE_SCALE)
+
+            optimizer.zero_grad()
+            (policy_loss + VALUE_LOSS_COEF * value_loss).backward()
+            optimizer.step()
+            policy_total += policy_loss.item()
+            value_total += value_loss.item()
+            batches += 1
+
+        print('Epoch: {:>4d}, Policy KL: {:g}, Value Loss: {:g}'.format(
+            epoch, policy_total / batches, value_total / batches), flush=True)
+
+# 留出局面上与教师的比较：合法走法中概率最大的一步是否相同，以及估值的平均绝对误差
+def agreement(student: torch.nn.Module, states: torch.Tensor, values: torch.Tensor, policys: torch.Tensor,
+    positions: torch.Tensor) -> Dict[str, float]:
+
+    student.eval()
+    with torch.no_grad():
+        value, policy = student(states.float())
+    legal = batchLegal(positions[:, 0], positions[:, 1], positions[:, 2])
+    same = torch.where(legal, policy + 1e-8, 0.).argmax(dim=-1) == torch.where(legal, policys + 1e-8, 0.).argmax(dim=-1)
+    return {
+        'agreement': same.float().mean().item(),
+        'value_mae': (value.view(-1) - values).abs().mean().item(),
+    }
+
+# 每步的平均用时（毫秒），只用网络走棋，单线程
+def latency(path: str, positions: torch.Tensor) -> float:
+    agent = Agent(endgame=None, book=None, path=path)
+    reversis = []
+    for black, white, next in positions.tolist():
+        reversi = Reversi()
+        reversi.load(toUnsigned(black), toUnsigned(white), next)
+        reversis.append(reversi)
+    agent.think(reversis[0], reversis[0].next) # 预热
+    t = time.perf_counter()
+    for reversi in reversis:
+        agent.think(reversi, reversi.next)
+    return (time.perf_counter() - t) / len(reversis) * 1000
+
+def report(teacherPath: str, studentPath: str, states: torch.Tensor, values: torch.Tensor, policys: torch.Tensor,
+    positions: torch.Tensor, games: int = GAMES) -> dict:
+
+    from tournament import roundRobin
+
+    result = agreement(loadNet(studentPath), states, values, policys, positions)
+    threads = torch.get_num_threads()
+    torch.set_num_threads(1)
+    result['teacher_ms'] = latency(teacherPath, positions[:LATENCY_MOVES])
+    result['student_ms'] = latency(studentPath, positions[:LATENCY_MOVES])
+    torch.set_num_threads(threads)
+    result['speedup'] = result['teacher_ms'] / result['student_ms']
+
+    tournament = roundRobin([teacherPath, studentPath, 'minimax'], games=games)
+    result['elo'] = tournament['elo']
+    for match in tournament['matches']:
+        if match['players'] == [teacherPath, studentPath]:
+            result['student_score'] = 1 - match['score'] # 前一个棋手是教师
+    return result
+
+def distill(teacherPath: str = TEACHER_PATH, studentPath: str = STUDENT_PATH) -> dict:
+    teacher = loadNet(teacherPath)
+    t = time.perf_counter()
+    states, values, policys, positions = selfPlay(teacher, POSITIONS + HELD_OUT)
+    print('Generated {} positions in {:g} seconds'.format(len(states), time.perf_counter() - t), flush=True)
+
+    student = Student()
+    train(student, states[HELD_OUT:], values[HELD_OUT:], policys[HELD_OUT:])
+    os.makedirs(os.path.dirname(studentPath) or '.', exist_ok=True)
+    torch.save(student.state_dict(), studentPath)
+
+    result = report(teacherPath, studentPath, states[:HELD_OUT], values[:HELD_OUT], policys[:HELD_OUT], positions[:HELD_OUT])
+    print('Agreement: {:.1%}, Value MAE: {:.2f}, Score vs teacher: {:.1%}'.format(
+        result['agreement'], result['value_mae'], result['student_score']))
+    print('Latency: teacher {:.2f} ms, student {:.2f} ms, x{:.1f}'.format(
+        result['teacher_ms'], result['student_ms'], result['speedup']))
+    for spec, rating in sorted(result['elo'].items(), key=lambda item: -item[1]):
+        print('{:>10.0f}  {}'.format(rating, spec))
+    return result
+
+if __name__ == '__main__':
+    distill(*sys.argv[1:3])
@@ -0,0 +1,119 @@
+from typing import List, Tuple
+
+from reversi import Reversi, Coordinate, SIZE, FULL, getMoves, getFlips
+from instrument import count
+
+# 终局精确求解：空格不多时直接搜索到终局，分数为当前走棋方与对方的棋子数之差（空格归胜方）
+# 采用 negamax + alpha-beta，只在位棋盘（own, opp）上计算，不经过 Reversi 对象
+
+EMPTIES = 10 # 空格不超过这么多时使用精确求解，agent.Agent 默认使用（minimax.Agent 默认用更小的 ENDGAME_EMPTIES）
+SHALLOW = 6 # 空格不超过这么多时只按奇偶性排序，不再计算对方的行动力
+WIN = SIZE * SIZE + 1 # 比任何棋子数之差都大
+
+# 四个象限的掩码，终局时一个象限内空格数为奇数的话，先在这里下的一方更可能拿到最后一步
+QUADRANTS = [sum(1 << (y * SIZE + x) for y in range(y0, y0 + SIZE // 2) for x in range(x0, x0 + SIZE // 2))
+    for y0 in (0, SIZE // 2) for x0 in (0, SIZE // 2)]
+CORNERS = (1 << 0) | (1 << (SIZE - 1)) | (1 << (SIZE * (SIZE - 1))) | (1 << (SIZE * SIZE - 1))
+
+nodes = 0 # 已搜索的节点数
+
+# 双方都不能下时的分数，空格归胜方
+def final(own: int, opp: int) -> int:
+    n1, n2 = own.bit_count(), opp.bit_count()
+    if n1 > n2:
+        return SIZE * SIZE - 2 * n2
+    elif n1 < n2:
+        return 2 * n1 - SIZE * SIZE
+    return 0
+
+# 只剩 square 一个空格时直接算出分数
+def lastMove(own: int, opp: int, square: int) -> int:
+    n = own.bit_count()
+    flips = getFlips(own, opp, square)
+    if flips:
+        return 2 * (n + flips.bit_count() + 1) - SIZE * SIZE
+    flips = getFlips(opp, own, square)
+    if flips:
+        return 2 * (n - flips.bit_count()) - SIZE * SIZE
+    return 2 * n + 2 - SIZE * SIZE if 2 * n >= SIZE * SIZE else 2 * n - SIZE * SIZE
+
+# 奇数象限优先，同一象限内按格子编号
+def parityOrder(moves: int, empty: int) -> List[int]:
+    odd, even = [], []
+    for quadrant in QUADRANTS:
+        bits = moves & quadrant
+        target = odd if (empty & quadrant).bit_count() & 1 else even
+        while bits:
+            move = bits & -bits
+            bits ^= move
+            target.append(move.bit_length() - 1)
+    return odd + even
+
+# 对方行动力少的走法优先（fastest-first），然后是角、奇数象限
+def mobilityOrder(own: int, opp: int, moves: int, empty: int) -> List[Tuple[int, int]]:
+    ordered = []
+    for quadrant in QUADRANTS:
+        bits = moves & quadrant
+        parity = (empty & quadrant).bit_count() & 1
+        while bits:
+            move = bits & -bits
+            bits ^= move
+            square = move.bit_length() - 1
+            flips = getFlips(own, opp, square)
+            mobility = getMoves(opp ^ flips, own | move | flips).bit_count()
+            ordered.append((mobility * 4 - (2 if move & CORNERS else 0) - parity, square, flips))
+    ordered.sort()
+    return [(square, flips) for _, square, flips in ordered]
+
+# 返回当前走棋方（own）在双方都走最优时的最终棋子数之差，结果限制在 [alpha, beta] 内
+def solve(own: int, opp: int, alpha: int, beta: int, passed: bool = False) -> int:
+    global nodes
+    nodes += 1
+
+    empty = FULL ^ (own | opp)
+    if empty & (empty - 1) == 0:
+        return lastMove(own, opp, empty.bit_length() - 1) if empty else final(own, opp)
+
+    moves = getMoves(own, opp)
+    if not moves:
+        if passed:
+            return final(own, opp)
+        return -solve(opp, own, -beta, -alpha, True)
+
+    if empty.bit_count() > SHALLOW:
+        for square, flips in mobilityOrder(own, opp, moves, empty):
+            score = -solve(opp ^ flips, own | (1 << square) | flips, -beta, -alpha)
+            if score > alpha:
+                alpha = score
+                if alpha >= beta:
+                    return alpha
+    else:
+        for square in parityOrder(moves, empty):
+            flips = getFlips(own, opp, square)
+            score = -solve(opp ^ flips, own | (1 << square) | flips, -beta, -alpha)
+            if score > alpha:
+                alpha = score
+                if alpha >= beta:
+                    return alpha
+    return alpha
+
+# 求解 reversi 当前局面，返回：(最佳走法, 走棋方最终领先的棋子数)
+def solveMove(reversi: Reversi) -> Tuple[Coordinate, int]:
+    global nodes
+    nodes = 0
+    who = reversi.next
+    own, opp = reversi.bitboards[who], reversi.bitboards[3 - who]
+    empty = FULL ^ (own | opp)
+
+    alpha, best = -WIN, None
+    for square, flips in mobilityOrder(own, opp, reversi.moves, empty):
+        score = -solve(opp ^ flips, own | (1 << square) | flips, -WIN, -alpha)
+        if score > alpha:
+            alpha, best = score, square
+    count('endgame.calls')
+    count('endgame.nodes', nodes)
+    return divmod(best, SIZE), alpha
+
+# 空格数是否满足精确求解的条件
+def solvable(reversi: Reversi, empties: int = EMPTIES) -> bool:
+    return reversi.next != 0 and SIZE * SIZE - reversi.number[1] - reversi.number[2] <= empties
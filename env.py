@@ -4,8 +4,9 @@ from multiprocessing import Pool
 import torch
 import itertools
 from reversi import Coordinate, Reversi, SIZE
-from minimax import Agent as Minimax # Minimax Agent
+from replycache import reply # Minimax 对手（经过应对缓存）
 from copy import deepcopy
+from instrument import timer
 
 # state, action, Return, next_state, done
 SARSD = Tuple[torch.Tensor, Coordinate, float, torch.Tensor, bool]
@@ -24,6 +25,28 @@ def getBoardState(reversi: Reversi) -> List[Matrix]:
         [[next for _ in range(SIZE)] for _ in range(SIZE)]
     ]
 
+# 每一行的 SIZE 个格子在位棋盘一个字节中对应的位
+BIT_MASKS = torch.tensor([1 << x for x in range(SIZE)], dtype=torch.uint8)
+BYTES = SIZE * SIZE // 8 # 一个位棋盘的字节数
+
+# 辅助函数，把多个棋盘的状态直接由位棋盘写入调用者预先分配的 (N, 3, SIZE, SIZE) 张量 out，不经过中间列表
+# out 也可以是 NumPy 数组，此时通过 torch.from_numpy 共享内存写入
+def encodeBoardStates(reversis: List[Reversi], out: torch.Tensor) -> torch.Tensor:
+    if not isinstance(out, torch.Tensor):
+        out = torch.from_numpy(out)
+    discs = bytearray(b''.join(r.bitboards[1].to_bytes(BYTES, 'little') + r.bitboards[2].to_bytes(BYTES, 'little') for r in reversis))
+    next = bytearray(2 - r.next for r in reversis)
+    out[:, :2].copy_((torch.frombuffer(discs, dtype=torch.uint8).view(-1, 2, SIZE, 1) & BIT_MASKS) != 0)
+    out[:, 2].copy_(torch.frombuffer(next, dtype=torch.uint8).view(-1, 1, 1).expand(-1, SIZE, SIZE))
+    return out
+
+# 辅助函数，把一个棋盘的状态写入调用者预先分配的 (3, SIZE, SIZE) 张量 out，格式与 getBoardState 相同
+def encodeBoardState(reversi: Reversi, out: torch.Tensor) -> torch.Tensor:
+    if not isinstance(out, torch.Tensor):
+        out = torch.from_numpy(out)
+    encodeBoardStates([reversi], out.unsqueeze(0))
+    return out
+
 # 辅助函数，检查place返回的状态，返回一个int，-1：对局未结束，0：平局，1：黑赢，2：白赢
 def checkPlaceStatus(status: str) -> int:
     if status.startswith('end'):
@@ -33,19 +56,12 @@ def checkPlaceStatus(status: str) -> int:
     elif status != 'ok':
         raise Exception('Should not reach here!')
 
-# 辅助函数，让当前棋局走一步，返回新棋盘、是否结束以及五元组
-def takeAction(arg: Tuple[Reversi, Coordinate, bool]) -> Tuple[Reversi, bool, SARSD]:
-    reversi, action, end = arg
-    # 棋局已结束
-    if end:
-        return reversi, True, None
-
+# 辅助函数，智能体在当前棋局走一步，Minimax 随后应对，返回是否结束以及reward
+def act(reversi: Reversi, action: Coordinate) -> Tuple[bool, float]:
     # 看看是黑棋还是白棋
     who = reversi.next
-    minimaxRole = 2 if who == 1 else 2
-    # 保存走之前的状态
-    s = torch.Tensor(getBoardState(reversi))
-    
+    minimaxRole = 2 if who == 1 else 1
+
     # 走棋
     status = reversi.place(action, reversi.next)
     result = checkPlaceStatus(status)
@@ -64,10 +80,11 @@ def takeAction(arg: Tuple[Reversi, Coordinate, bool]) -> Tuple[Reversi, bool, SA
             reward = 0
     else:
         # 若未结束，Minimax走棋再计算reward
-        while not end and reversi.next == minimaxRole:
-            status = reversi.place(Minimax.brain(reversi, minimaxRole), minimaxRole)
-            result = checkPlaceStatus(status)
-            end = (result != -1)
+        with timer('env.opponent'):
+            while not end and reversi.next == minimaxRole:
+                status = reversi.place(reply(reversi, minimaxRole), minimaxRole)
+                result = checkPlaceStatus(status)
+                end = (result != -1)
         
         if result == who:
             reward = 100
@@ -82,8 +99,22 @@ def takeAction(arg: Tuple[Reversi, Coordinate, bool]) -> Tuple[Reversi, bool, SA
         else:
             reward = 0
 
+    return end, reward
+
+# 辅助函数，让当前棋局走一步，返回新棋盘、是否结束以及五元组
+def takeAction(arg: Tuple[Reversi, Coordinate, bool]) -> Tuple[Reversi, bool, SARSD]:
+    reversi, action, end = arg
+    # 棋局已结束
+    if end:
+        return reversi, True, None
+
+    # 保存走之前的状态
+    s = encodeBoardState(reversi, torch.empty(3, SIZE, SIZE))
+
+    end, reward = act(reversi, action)
+
     # 获取更新的状态
-    sn = torch.Tensor(getBoardState(reversi))
+    sn = encodeBoardState(reversi, torch.empty(3, SIZE, SIZE))
 
     return reversi, end, [s, action, reward, sn, end]
 
@@ -103,10 +134,9 @@ class Envs:
         self.end = [False for _ in range(self.num_workers)]
         black = Reversi()
         white = Reversi()
-        white.place(Minimax.brain(white, 1), 1)
+        white.place(reply(white, 1), 1)
         self.reversis = [deepcopy(black) for _ in range(self.num_workers // 2)] + [deepcopy(white) for _ in range(self.num_workers // 2)]
-        states = self.pool.map(getBoardState, self.reversis)
-        return torch.Tensor(states)
+        return encodeBoardStates(self.reversis, torch.empty(self.num_workers // 2 * 2, 3, SIZE, SIZE))
 
     # 让所有棋盘都走一步，输入：坐标列表
     # 返回值：第一个值表示所有环境是否结束，第二个是next_state (num_worker, 3, SIZE, SIZE)
@@ -0,0 +1,115 @@
+from typing import List, Tuple
+
+import os
+import random
+import sys
+import tempfile
+import time
+import torch
+import torch.nn as nn
+from torch.nn.utils.fusion import fuse_conv_bn_eval
+from reversi import Reversi, SIZE
+from model import loadNet
+from vecenv import batchLegal, batchStates, toSigned
+
+# CPU 推理用的编译模型：BatchNorm 折叠进前面的卷积，全连接层动态量化为 int8，再用 TorchScript 冻结
+# 卷积保持 float：静态量化卷积需要在网络中加入量化/反量化节点，残差相加也要改成量化的加法
+# 编译结果保存在检查点旁边（models/good.pt -> models/good.int8.jit），检查点更新后重新编译
+# 编译时在随机局面上与 float 模型比较合法走法中概率最大的一步，一致率低于 AGREEMENT 时报错，不写缓存
+# 用法：python inference.py [检查点]，编译并报告一致率和每步用时
+
+AGREEMENT = 0.98 # 与 float 模型的最低走法一致率
+CHECK_POSITIONS = 1000 # 检查一致率使用的随机局面数
+LATENCY_REPEAT = 200
+
+def cachePath(path: str) -> str:
+    return os.path.splitext(path)[0] + '.int8.jit'
+
+# 把每个 BatchNorm2d 折叠进紧挨在它前面注册的 Conv2d，BatchNorm2d 换成 Identity
+# ActorCritic 的 conv/bn 成对注册，Sequential 中 bn 紧跟在 conv 之后，都满足这个条件
+def foldBatchNorm(module: nn.Module):
+    previous = None
+    for name, child in list(module.named_children()):
+        if isinstance(child, nn.BatchNorm2d) and previous is not None and isinstance(getattr(module, previous), nn.Conv2d):
+            setattr(module, previous, fuse_conv_bn_eval(getattr(module, previous), child))
+            setattr(module, name, nn.Identity())
+        else:
+            foldBatchNorm(child)
+        previous = name
+
+def compileNet(net: nn.Module) -> torch.jit.ScriptModule:
+    net.eval()
+    foldBatchNorm(net)
+    net = torch.ao.quantization.quantize_dynamic(net, {nn.Linear}, dtype=torch.qint8)
+    with torch.no_grad():
+        return torch.jit.freeze(torch.jit.script(net))
+
+# 随机走若干步得到的局面，返回：(状态, 可下位置)
+def randomPositions(count: int = CHECK_POSITIONS, seed: int = 0) -> Tuple[torch.Tensor, torch.Tensor]:
+    rnd = random.Random(seed)
+    positions: List[Tuple[int, int, int]] = []
+    while len(positions) < count:
+        reversi = Reversi()
+        for _ in range(rnd.randint(0, SIZE * SIZE - 8)):
+            moves = reversi.moves
+            squares = [square for square in range(SIZE * SIZE) if moves >> square & 1]
+            reversi.place(divmod(rnd.choice(squares), SIZE), reversi.next)
+            if reversi.next == 0:
+                break
+        if reversi.next != 0:
+            positions.append((toSigned(reversi.bitboards[1]), toSigned(reversi.bitboards[2]), reversi.next))
+    black, white, next = torch.tensor(positions, dtype=torch.int64).unbind(dim=1)
+    return batchStates(black, white, next), batchLegal(black, white, next)
+
+# 两个模型在同一批局面上合法走法中概率最大的一步相同的比例
+def agreement(a: nn.Module, b: nn.Module, states: torch.Tensor, legal: torch.Tensor) -> float:
+    with torch.no_grad():
+        moves = [torch.where(legal, net(states)[1] + 1e-8, 0.).argmax(dim=-1) for net in (a, b)]
+    return (moves[0] == moves[1]).float().mean().item()
+
+# 先写到同目录的临时文件再替换，多个进程同时编译时不会读到写了一半的缓存
+def saveAtomic(module: torch.jit.ScriptModule, path: str):
+    fd, temp = tempfile.mkstemp(dir=os.path.dirname(path) or '.', suffix='.tmp')
+    os.close(fd)
+    try:
+        torch.jit.save(module, temp)
+        os.replace(temp, path)
+    except BaseException:
+        os.remove(temp)
+        raise
+
+# 编译 path 的检查点，检查一致率后写入缓存，返回：(编译后的模型, 一致率)
+def build(path: str, threshold: float = AGREEMENT) -> Tuple[torch.jit.ScriptModule, float]:
+    compiled = compileNet(loadNet(path))
+    rate = agreement(loadNet(path).eval(), compiled, *randomPositions())
+    if rate < threshold:
+        raise Exception('Compiled model of {} agrees with the float model on {:.1%} of moves, below {:.1%}'.format(
+            path, rate, threshold))
+    saveAtomic(compiled, cachePath(path))
+    return compiled, rate
+
+# 载入编译后的模型，缓存不存在或比检查点旧时重新编译
+def load(path: str, threshold: float = AGREEMENT) -> torch.jit.ScriptModule:
+    cache = cachePath(path)
+    if os.path.exists(cache) and os.path.getmtime(cache) >= os.path.getmtime(path):
+        return torch.jit.load(cache, map_location='cpu')
+    return build(path, threshold)[0]
+
+# 单个局面前向计算的平均用时（毫秒）
+def latency(net: nn.Module, repeat: int = LATENCY_REPEAT) -> float:
+    state = torch.zeros(1, 3, SIZE, SIZE)
+    with torch.no_grad():
+        net(state) # 预热
+        t = time.perf_counter()
+        for _ in range(repeat):
+            net(state)
+    return (time.perf_counter() - t) / repeat * 1000
+
+if __name__ == '__main__':
+    from agent import MODEL_PATH
+    path = sys.argv[1] if len(sys.argv) > 1 else MODEL_PATH
+    torch.set_num_threads(1)
+    compiled, rate = build(path)
+    eager = loadNet(path).eval()
+    print('Saved {}, agreement: {:.1%}'.format(cachePath(path), rate))
+    print('Latency: float {:.2f} ms, compiled {:.2f} ms'.format(latency(eager), latency(compiled)))
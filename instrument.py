@@ -0,0 +1,116 @@
+from typing import Dict, List, Optional
+
+import csv
+import json
+import os
+import time
+
+# 轻量的计时和计数：训练各阶段的用时、Minimax 搜索的统计等
+# 关闭时 timer 返回同一个空的上下文管理器，count 直接返回，几乎没有开销
+# 子进程（进程池、常驻进程）中的统计用 take 取出后随结果发回，由主进程 merge 合并
+# 开关同时写入环境变量，之后创建的子进程无论 fork 还是 spawn 都能继承
+
+ENV_VAR = 'REVERSI_INSTRUMENT'
+ENABLED = os.environ.get(ENV_VAR) == '1'
+
+timers: Dict[str, float] = {}   # 名称 -> 累计秒数
+counters: Dict[str, int] = {}   # 名称 -> 累计数值
+
+def enable(on: bool = True):
+    global ENABLED
+    ENABLED = on
+    os.environ[ENV_VAR] = '1' if on else '0'
+
+class Timer:
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self) -> 'Timer':
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        timers[self.name] = timers.get(self.name, 0.) + time.perf_counter() - self.start
+
+class NullTimer:
+    def __enter__(self) -> 'NullTimer':
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+NULL_TIMER = NullTimer()
+
+# with timer('name'): ... 统计代码块的累计用时
+def timer(name: str):
+    return Timer(name) if ENABLED else NULL_TIMER
+
+def count(name: str, n: int = 1):
+    if ENABLED:
+        counters[name] = counters.get(name, 0) + n
+
+def reset():
+    timers.clear()
+    counters.clear()
+
+# 取出当前进程的统计并清零，关闭时返回 None
+def take() -> Optional[dict]:
+    if not ENABLED:
+        return None
+    snapshot = {'timers': dict(timers), 'counters': dict(counters)}
+    reset()
+    return snapshot
+
+# 合并子进程发回的统计，子进程的用时是各进程之和，可能超过实际经过的时间
+def merge(snapshot: Optional[dict]):
+    if not snapshot:
+        return
+    for name, seconds in snapshot['timers'].items():
+        timers[name] = timers.get(name, 0.) + seconds
+    for name, n in snapshot['counters'].items():
+        counters[name] = counters.get(name, 0) + n
+
+# 合成一行记录：用时以 'time.' 开头，计数保持原名
+def summary() -> dict:
+    row = {'time.' + name: seconds for name, seconds in sorted(timers.items())}
+    row.update(sorted(counters.items()))
+    return row
+
+class Log:
+    # 按文件扩展名写 CSV 或 JSONL，每次 write 一行
+    # 各回合的计数不一定相同（如开局库命中、终局求解只在部分回合出现），
+    # CSV 遇到新字段时把已有的行按扩充后的表头重写一遍，之前的行中新字段留空
+    def __init__(self, path: str):
+        self.path = path
+        self.csv = path.endswith('.csv')
+        self.fields: List[str] = []
+        if self.csv and os.path.exists(path):
+            with open(path, newline='') as f:
+                self.fields = next(csv.reader(f), [])
+        self.file = open(path, 'a', newline='')
+
+    def write(self, row: dict):
+        if self.csv:
+            new = [name for name in row if name not in self.fields]
+            if new:
+                self.rewrite(self.fields + new)
+            csv.DictWriter(self.file, fieldnames=self.fields, restval='').writerow(row)
+        else:
+            self.file.write(json.dumps(row) + '\n')
+        self.file.flush()
+
+    # 按新的表头重写整个 CSV 文件
+    def rewrite(self, fields: List[str]):
+        self.file.close()
+        with open(self.path, newline='') as f:
+            rows = list(csv.DictReader(f)) if self.fields else []
+        self.fields = fields
+        self.file = open(self.path, 'w', newline='')
+        writer = csv.DictWriter(self.file, fieldnames=fields, restval='')
+        writer.writeheader()
+        writer.writerows(rows)
+
+    def close(self):
+        self.file.close()
@@ -1,15 +1,21 @@
-from typing import List, Tuple
+from typing import Iterator, List, Tuple
 
 import torch
 import torch.optim
 from torch.distributions.categorical import Categorical
-from torch.utils.data import Dataset, DataLoader
-import torchvision.transforms.functional as TF
-from env import SARSD, Envs
+from torch.utils.data import Dataset, DataLoader, Sampler
+from env import SARSD
+from vecenv import VecEnvs
+from sharedenv import SharedEnvs
 from model import ActorCritic
 from reversi import SIZE
+from symmetry import SOURCES, TARGETS, SYMMETRIES
+from replay import ReplayStore
+import instrument
+from instrument import timer
+import replycache
 import os
-import itertools
+import time
 
 GAMMA = 0.9
 EPISODES = 10_000
@@ -18,29 +24,158 @@ NUM_WORKERS = 56
 BATCH_SIZE = 64
 VALUE_LOSS_COEF = 0.1
 ENTROPY_LOSS_COEF = 0.05
+SHARED_ENVS = False # 使用常驻进程和共享内存的环境，否则使用批量位棋盘环境
+AUGMENT = 'all' # 对称变换方式，'all'：8 种全用；'random'：每个样本随机一种
+REPLAY_PATH = None # 设置后把每回合的样本追加到该回放文件中，训练时额外从中采样
+REPLAY_CAPACITY = 4_000_000 # 回放文件最多保存的样本数，超出后丢弃最早的样本
+REPLAY_BATCHES = 16 # 每回合额外从回放文件中采样训练的 batch 数
+REPLAY_ALPHA = 0. # 0 为均匀采样，否则按优先级（|advantage|）的 alpha 次方采样
+INSTRUMENT_LOG = None # 设置后（.csv 或 .jsonl）记录每回合各阶段的用时和 Minimax 搜索统计
+CONTINUOUS = False # 连续采样：每个棋盘结束后各自立即重新开局，每回合采集 SEGMENT 步，用 critic 的估值补全未结束对局的 Return（需要 VecEnvs）
+SEGMENT = 16 # 连续采样时每回合的步数
+REPLY_CACHE = replycache.CAPACITY # 各进程共享的 Minimax 应对缓存的局面数，None 表示不使用
+
+# 每个回合最多的样本数：每盘棋智能体最多下 SIZE * SIZE 步
+CAPACITY = NUM_WORKERS * SIZE * SIZE
+SYMMETRY_SOURCES = torch.tensor(SOURCES)
+SYMMETRY_TARGETS = torch.tensor(TARGETS)
+
+# 对一个 batch 做对称变换，states 为 (N, 3, SIZE, SIZE) 的 uint8 张量，返回 float 状态
+def augment(states: torch.Tensor, actions: torch.Tensor, Returns: torch.Tensor,
+    mode: str = AUGMENT) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+
+    if mode == 'all':
+        ks = torch.arange(SYMMETRIES).repeat(len(states))
+        states = states.repeat_interleave(SYMMETRIES, dim=0)
+        actions = actions.repeat_interleave(SYMMETRIES)
+        Returns = Returns.repeat_interleave(SYMMETRIES)
+    else:
+        ks = torch.randint(SYMMETRIES, (len(states),))
+
+    # 按每个样本的变换对 SIZE * SIZE 个格子做一次 gather
+    flat = states.view(len(ks), 3, SIZE * SIZE)
+    index = SYMMETRY_SOURCES[ks].unsqueeze(1).expand(-1, 3, -1)
+    states = torch.gather(flat, 2, index).view(-1, 3, SIZE, SIZE).float()
+    actions = SYMMETRY_TARGETS[ks, actions]
+    return states, actions, Returns
 
 class EpisodeData(Dataset):
     # 为了使用DataLoader
-    def __init__(self, data: List[SARSD]):
+    # 每个样本只存一份，状态以 uint8 存在共享内存中，DataLoader 的常驻 worker 在各回合之间直接读取新数据
+    # 因为棋盘具有 8 种对称性，取一个 batch 时对整批状态做对称变换，动作编号查表映射
+    # augment 为 'all' 时每个样本 8 种变换全用（batch 扩大 8 倍），为 'random' 时每个样本随机用一种
+    def __init__(self, capacity: int = CAPACITY, augment: str = AUGMENT):
         super(EpisodeData, self).__init__()
-        self.data = []
-        # 对数据格式稍微转换一下，并抛弃不需要的数据
-        # 因为棋盘具有旋转对称性，对所有状态都进行旋转，增加数据量
-        for s, (y, x), R, _, _ in data:
-            a = y * SIZE + x
-            self.data.append((s, a, R))
-            a = SIZE*SIZE - SIZE - SIZE*(a % SIZE) + (a // SIZE) # 推导得出的旋转90度的坐标
-            self.data.append((TF.rotate(s, 90), a, R))
-            a = SIZE*SIZE - SIZE - SIZE*(a % SIZE) + (a // SIZE)
-            self.data.append((TF.rotate(s, 180), a, R))
-            a = SIZE*SIZE - SIZE - SIZE*(a % SIZE) + (a // SIZE)
-            self.data.append((TF.rotate(s, 270), a, R))
-    
+        self.states = torch.zeros(capacity, 3, SIZE, SIZE, dtype=torch.uint8).share_memory_()
+        self.actions = torch.zeros(capacity, dtype=torch.int64).share_memory_()
+        self.Returns = torch.zeros(capacity).share_memory_()
+        self.size = 0
+        self.augment = augment
+
+    # 载入一个回合的数据，抛弃不需要的部分
+    def load(self, data: List[SARSD]):
+        self.size = min(len(data), len(self.states))
+        data = data[:self.size]
+        if not data:
+            return
+        self.states[:self.size].copy_(torch.stack([s for s, _, _, _, _ in data]))
+        self.actions[:self.size].copy_(torch.tensor([y * SIZE + x for _, (y, x), _, _, _ in data]))
+        self.Returns[:self.size].copy_(torch.tensor([R for _, _, R, _, _ in data]))
+
+    def __len__(self) -> int:
+        return self.size
+
+    # idx 为一个 batch 的下标
+    def __getitem__(self, idx: List[int]) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+        idx = torch.as_tensor(idx)
+        return augment(self.states[idx], self.actions[idx], self.Returns[idx], self.augment)
+
+class EpisodeSampler(Sampler):
+    # 每次迭代时按当前的数据量重新打乱，产生各个 batch 的下标
+    def __init__(self, data: EpisodeData, batch_size: int):
+        self.data = data
+        self.batch_size = batch_size
+
+    def __iter__(self) -> Iterator[List[int]]:
+        return (idx.tolist() for idx in torch.randperm(len(self.data)).split(self.batch_size))
+
     def __len__(self) -> int:
-        return len(self.data)
+        return (len(self.data) + self.batch_size - 1) // self.batch_size
+
+# 用 net 在 envs 的所有棋盘上采集一回合数据
+def rollout(net: ActorCritic, envs: VecEnvs, device: torch.device) -> List[SARSD]:
+    net.eval()
+    with torch.no_grad():
+        with timer('env.reset'):
+            states = envs.reset()
+        done = False
+        while not done:
+            with timer('rollout.forward'):
+                states = states.to(device)
+                _, policys = net(states)
+                policys = policys.cpu() # 移到CPU上处理比较好
+                # 不能下的位置概率填 0，已结束的棋盘不做处理
+                legal = envs.legal(ended=True)
+                policys = torch.where(legal, policys + 1e-8, 0.) # 防止概率全为 0
+                actions = Categorical(probs=policys).sample()
+            with timer('env.step'):
+                done, states = envs.step(actions)
+            instrument.count('rollout.steps')
+
+    envs.setReturn()
+    return envs.readHistory()
+
+# 连续采样一段：envs 的棋盘接着上一段继续下 length 步，结束的棋盘各自重新开局
+# 片段末尾还没结束的对局用 critic 对最后状态的估值作为之后的 Return
+def rolloutSegment(net: ActorCritic, envs: VecEnvs, device: torch.device, length: int = SEGMENT) -> List[SARSD]:
+    net.eval()
+    envs.segment()
+    with torch.no_grad():
+        states = envs.states()
+        for _ in range(length):
+            with timer('rollout.forward'):
+                states = states.to(device)
+                _, policys = net(states)
+                policys = policys.cpu()
+                policys = torch.where(envs.legal(), policys + 1e-8, 0.) # 防止概率全为 0
+                actions = Categorical(probs=policys).sample()
+            with timer('env.step'):
+                states = envs.advance(actions)
+            instrument.count('rollout.steps')
+
+        with timer('rollout.forward'):
+            values, _ = net(states.to(device))
+
+    envs.setReturn(values.cpu())
+    return envs.readHistory()
+
+# 用一个 batch 训练一步，返回：(value loss, 熵, 每个样本 advantage 的绝对值)
+def trainBatch(net: ActorCritic, optimizer: torch.optim.Optimizer, device: torch.device,
+    states: torch.Tensor, actions: torch.Tensor, Returns: torch.Tensor) -> Tuple[float, float, torch.Tensor]:
+
+    states, actions, Returns = states.to(device), actions.to(device), Returns.to(device)
+    values, policys = net(states)
+
+    dist = Categorical(probs=policys)
+    action_log_probs = dist.log_prob(actions).view(-1, 1)
+    dist_entropy = dist.entropy().mean() # 我们希望分布的熵更大些，保持模型的探索性
+
+    advantages = Returns.view(-1, 1) - values
     
-    def __getitem__(self, idx: int) -> Tuple[torch.Tensor, int, float]:
-        return self.data[idx]
+    value_loss = advantages.pow(2).mean()
+    action_loss = -(advantages.detach() * action_log_probs).mean()
+
+    optimizer.zero_grad()
+    (VALUE_LOSS_COEF * value_loss + action_loss - ENTROPY_LOSS_COEF * dist_entropy).backward()
+    optimizer.step()
+
+    return value_loss.item(), dist_entropy.item(), advantages.detach().abs().view(-1).cpu()
+
+# 保存第 n 个检查点
+def save(net: ActorCritic, n: int):
+    if not os.path.isdir('models'):
+        os.mkdir('models')
+    torch.save(net.state_dict(), 'models/{}.pt'.format(n))
 
 def main():
     # 确定神经网络计算设备
@@ -53,35 +188,40 @@ def main():
     # 准备优化器
     optimizer = torch.optim.Adam(net.parameters(), lr=3e-4)
 
+    # 要在创建子进程之前打开统计
+    log = None
+    if INSTRUMENT_LOG is not None:
+        instrument.enable()
+        log = instrument.Log(INSTRUMENT_LOG)
+
+    # 应对缓存放在共享内存中，同样要在创建子进程之前打开
+    if REPLY_CACHE is not None:
+        replycache.enable(REPLY_CACHE)
+
     # 准备环境
-    envs = Envs(NUM_WORKERS, gamma=GAMMA)
+    envs = (SharedEnvs if SHARED_ENVS else VecEnvs)(NUM_WORKERS, gamma=GAMMA)
+    if CONTINUOUS:
+        envs.reset()
+
+    # 准备数据，'all' 模式下每个样本扩展为 8 个，batch 中的原始样本数相应减少
+    data = EpisodeData()
+    samples = max(BATCH_SIZE // SYMMETRIES, 1) if AUGMENT == 'all' else BATCH_SIZE
+    loader = DataLoader(data, batch_size=None, sampler=EpisodeSampler(data, samples), num_workers=2, persistent_workers=True)
+    replay = ReplayStore(REPLAY_PATH, REPLAY_CAPACITY) if REPLAY_PATH is not None else None
     
     # 开始训练
     for episode in range(EPISODES):
+        instrument.reset()
+        start = time.perf_counter()
 
         # 从多个环境采集一回合数据
-        net.eval()
-        with torch.no_grad():
-            states = envs.reset()
-            done = False
-            while not done:
-                states = states.to(device)
-                _, policys = net(states)
-                policys = policys.cpu() # 移到CPU上处理比较好
-                # 不能下的位置概率填 0
-                for i in range(NUM_WORKERS):
-                    if envs.reversis[i].next != 0:
-                        for y, x in itertools.product(range(SIZE), repeat=2):
-                            if not envs.reversis[i].good[y][x]:
-                                policys[i][y * SIZE + x] = 0.
-                            else:
-                                policys[i][y * SIZE + x] += 1e-8 # 防止概率全为 0
-                actions = Categorical(probs=policys).sample()
-                done, states = envs.step(actions)
+        history = rolloutSegment(net, envs, device) if CONTINUOUS else rollout(net, envs, device)
         
-        envs.setReturn()
-        data = EpisodeData(envs.readHistory())
-        loader = DataLoader(data, batch_size=BATCH_SIZE, shuffle=True, num_workers=2)
+        with timer('data'):
+            data.load(history)
+            if replay is not None:
+                replay.append(history)
+        instrument.count('data.samples', len(history))
 
         # 训练网络
         net.train()
@@ -89,37 +229,52 @@ def main():
         # 相关指标
         value_loss_total = 0.
         entropy_total = 0.
+        batches = 0
 
-        for states, actions, Returns in loader:
-            states, actions, Returns = states.to(device), actions.to(device), Returns.to(device)
-            values, policys = net(states)
-
-            dist = Categorical(probs=policys)
-            action_log_probs = dist.log_prob(actions).view(-1, 1)
-            dist_entropy = dist.entropy().mean() # 我们希望分布的熵更大些，保持模型的探索性
+        def train(states: torch.Tensor, actions: torch.Tensor, Returns: torch.Tensor) -> torch.Tensor:
+            nonlocal value_loss_total, entropy_total, batches
+            instrument.count('train.samples', len(states))
+            with timer('train.step'):
+                value_loss, entropy, advantages = trainBatch(net, optimizer, device, states, actions, Returns)
+            value_loss_total += value_loss
+            entropy_total += entropy
+            batches += 1
+            return advantages
 
-            advantages = Returns.view(-1, 1) - values
-            
-            value_loss = advantages.pow(2).mean()
-            action_loss = -(advantages.detach() * action_log_probs).mean()
+        # train 包含等待 DataLoader 取数据的时间，train.step 只有前向、反向和更新参数
+        with timer('train'):
+            for states, actions, Returns in loader:
+                train(states, actions, Returns)
 
-            optimizer.zero_grad()
-            (VALUE_LOSS_COEF * value_loss + action_loss - ENTROPY_LOSS_COEF * dist_entropy).backward()
-            optimizer.step()
-
-            value_loss_total += value_loss.item()
-            entropy_total += dist_entropy.item()
+            # 从回放文件中采样以前回合的样本
+            if replay is not None:
+                for _ in range(REPLAY_BATCHES):
+                    states, actions, Returns, _, idx = replay.sample(BATCH_SIZE, REPLAY_ALPHA)
+                    priorities = train(states, actions, Returns)
+                    if REPLAY_ALPHA != 0.:
+                        replay.update(idx, priorities)
         
         print('Episode: {:>10d}, Value Loss: {:g}, Entropy: {:g}'.format(
             episode,
-            value_loss_total / len(loader),
-            entropy_total / len(loader)
+            value_loss_total / max(batches, 1),
+            entropy_total / max(batches, 1)
             ), flush=True)
+
+        if log is not None:
+            log.write({
+                'episode': episode,
+                'value_loss': value_loss_total / max(batches, 1),
+                'entropy': entropy_total / max(batches, 1),
+                'batches': batches,
+                'time.episode': time.perf_counter() - start,
+                **instrument.summary(),
+                **replycache.summary(),
+            })
         
         if episode != 0 and episode % SAVE_INTERVAL == 0:
-            if not os.path.isdir('models'):
-                os.mkdir('models')
-            torch.save(net.state_dict(), 'models/{}.pt'.format(episode // SAVE_INTERVAL))
+            save(net, episode // SAVE_INTERVAL)
+            if replycache.cache is not None:
+                print(replycache.cache.report(), flush=True)
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -0,0 +1,166 @@
+from typing import Dict, List, Optional, Tuple
+
+import math
+import time
+import torch
+from reversi import Coordinate, Reversi, SIZE
+from agent import Agent, BACKEND, MODEL_PATH
+from vecenv import batchLegal, batchStates, toSigned
+from endgame import EMPTIES
+from book import BOOK_PATH
+
+# 蒙特卡洛树搜索：策略头的输出作为先验概率，价值头的输出作为叶子的估值（PUCT）
+# 每轮沿树选出最多 BATCH 个叶子，选择路径上加虚拟损失让后面的选择避开同一条路径，
+# 然后把这些叶子合成一个 batch 做一次前向计算，展开并回传
+# 走棋后保留选中的子树，下一步如果对方的应对在树中就从那里继续搜索
+
+SIMULATIONS = 400 # 每步的模拟次数，与 TIME_LIMIT 同时给出时先达到者为准
+TIME_LIMIT = None # 每步思考的时间上限（秒）
+BATCH = 16 # 每次前向计算的叶子数
+C_PUCT = 1.5
+VIRTUAL_LOSS = 1
+VALUE_SCALE = 100. # 价值头输出的是 Return（胜负奖励为 ±100），除以它得到 [-1, 1] 之间的估值
+
+class Node:
+    # who 为该局面轮到谁走，0 表示对局结束；N、W 为访问次数和累计价值，都以父节点走棋方的视角计算
+    __slots__ = ('who', 'hash', 'prior', 'N', 'W', 'children', 'terminal', 'pending')
+
+    def __init__(self, who: int, hash: int, prior: float):
+        self.who = who
+        self.hash = hash
+        self.prior = prior
+        self.N = 0
+        self.W = 0.
+        self.children: Optional[Dict[int, Node]] = None # 格子编号 -> 子节点，None 表示还没有展开
+        self.terminal = 0. # 对局结束时父节点走棋方的得分
+        self.pending = False # 已选中、等待本轮 batch 估值
+
+    # PUCT 选择子节点
+    def select(self) -> Tuple[int, 'Node']:
+        sqrtN = math.sqrt(max(self.N, 1))
+        best, bestScore = None, -float('inf')
+        for square, child in self.children.items():
+            q = child.W / child.N if child.N else 0.
+            score = q + C_PUCT * child.prior * sqrtN / (1 + child.N)
+            if score > bestScore:
+                best, bestScore = (square, child), score
+        return best
+
+class MCTSAgent(Agent):
+    def __init__(self, simulations: Optional[int] = SIMULATIONS, timeLimit: Optional[float] = TIME_LIMIT,
+        batch: int = BATCH, endgame: Optional[int] = EMPTIES, book: Optional[str] = BOOK_PATH, path: str = MODEL_PATH,
+        backend: str = BACKEND):
+
+        if simulations is None and timeLimit is None:
+            raise Exception('MCTSAgent needs simulations or timeLimit')
+        super(MCTSAgent, self).__init__(endgame, book, path, backend)
+        self.simulations = simulations
+        self.timeLimit = timeLimit
+        self.batch = batch
+        self.root: Optional[Node] = None
+
+    # 在上一步保留的子树中找当前局面（对方走了一步，或者己方无棋可走时对方走了多步）
+    def reuse(self, reversi: Reversi) -> Node:
+        frontier = [self.root] if self.root is not None else []
+        for _ in range(3):
+            for node in frontier:
+                if node.hash == reversi.hash and node.who == reversi.next:
+                    return node
+            frontier = [child for node in frontier if node.children for child in node.children.values()]
+        return Node(reversi.next, reversi.hash, 1.)
+
+    def think(self, reversi: Reversi, who: int) -> Coordinate:
+        root = self.reuse(reversi)
+        deadline = None if self.timeLimit is None else time.perf_counter() + self.timeLimit
+        simulations = 0
+        if root.children is None:
+            self.evaluate([(root, reversi.bitboards[1], reversi.bitboards[2], reversi.next, [root])])
+
+        while (self.simulations is None or simulations < self.simulations) and \
+            (deadline is None or time.perf_counter() < deadline):
+
+            leaves = []
+            # 只计入回传了结果或加入了本轮 batch 的选择
+            for _ in range(self.batch if self.simulations is None else min(self.batch, self.simulations - simulations)):
+                if not self.descend(root, reversi, leaves):
+                    break
+                simulations += 1
+            if leaves:
+                self.evaluate(leaves)
+
+        square, self.root = max(root.children.items(), key=lambda item: item[1].N)
+        return divmod(square, SIZE)
+
+    # 从根出发选到一个叶子，结束的局面直接回传，
+    # 未展开的叶子在路径上加虚拟损失，以 (节点, 黑棋, 白棋, 轮到谁, 路径) 加入 leaves 等待估值
+    # 选到了本轮已经选过的叶子时返回 False，结束本轮的选择
+    def descend(self, root: Node, reversi: Reversi, leaves: List[tuple]) -> bool:
+        path = [root]
+        node = root
+        played = 0
+        while node.children:
+            square, child = node.select()
+            reversi.place(divmod(square, SIZE), node.who)
+            played += 1
+            path.append(child)
+            node = child
+            if node.who == 0:
+                break
+
+        selected = not node.pending
+        if node.who == 0: # 对局结束
+            self.backup(path, path[-2].who, node.terminal)
+        elif selected:
+            node.pending = True
+            for n in path[1:]:
+                n.N += VIRTUAL_LOSS
+                n.W -= VIRTUAL_LOSS
+            leaves.append((node, reversi.bitboards[1], reversi.bitboards[2], reversi.next, path))
+
+        for _ in range(played):
+            reversi.unplace()
+        return selected
+
+    # 对一批叶子做一次前向计算，展开并回传
+    def evaluate(self, leaves: List[tuple]):
+        black = torch.tensor([toSigned(b) for _, b, _, _, _ in leaves], dtype=torch.int64)
+        white = torch.tensor([toSigned(w) for _, _, w, _, _ in leaves], dtype=torch.int64)
+        next = torch.tensor([n for _, _, _, n, _ in leaves], dtype=torch.int64)
+        with torch.no_grad():
+            values, policys = self.net(batchStates(black, white, next))
+        legal = batchLegal(black, white, next)
+        priors = torch.where(legal, policys + 1e-8, 0.)
+        priors = (priors / priors.sum(dim=-1, keepdim=True)).tolist()
+        values = (values.view(-1) / VALUE_SCALE).clamp(-1., 1.).tolist()
+        legal = legal.tolist()
+
+        for (node, b, w, n, path), prior, value, moves in zip(leaves, priors, values, legal):
+            self.expand(node, b, w, n, prior, moves)
+            node.pending = False
+            for p in path[1:]:
+                p.N -= VIRTUAL_LOSS
+                p.W += VIRTUAL_LOSS
+            self.backup(path, node.who, value)
+
+    # 为所有可下的位置建立子节点，需要走一步来得到子节点的轮到谁和哈希
+    def expand(self, node: Node, black: int, white: int, next: int, prior: List[float], moves: List[bool]):
+        reversi = Reversi()
+        reversi.load(black, white, next)
+        node.children = {}
+        for square in range(SIZE * SIZE):
+            if not moves[square]:
+                continue
+            reversi.place(divmod(square, SIZE), next)
+            child = Node(reversi.next, reversi.hash, prior[square])
+            if reversi.next == 0:
+                own, opp = reversi.number[next], reversi.number[3 - next]
+                child.terminal = 1. if own > opp else -1. if own < opp else 0.
+            node.children[square] = child
+            reversi.unplace()
+
+    # 回传 value（以 who 的视角），每条边按父节点走棋方的视角累计
+    def backup(self, path: List[Node], who: int, value: float):
+        for parent, child in zip(path, path[1:]):
+            child.N += 1
+            child.W += value if parent.who == who else -value
+        path[0].N += 1
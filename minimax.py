@@ -1,8 +1,12 @@
-from typing import Tuple
+from typing import Dict, List, Optional, Tuple
 
-import itertools
-from reversi import Reversi, Coordinate
-from copy import deepcopy
+from multiprocessing import Pool
+import multiprocessing
+import time
+from reversi import Reversi, Coordinate, SIZE, WeightTable
+from endgame import solvable, solveMove
+from book import BOOK_PATH, probe
+from instrument import count
 
 evaluate_matrix = [[100, -20, 50, 25, 25, 50, -20, 100],
                    [-20, 80, 25, 10, 10, 25, 80, -20],
@@ -13,55 +17,332 @@ evaluate_matrix = [[100, -20, 50, 25, 25, 50, -20, 100],
                    [-20, 80, 25, 10, 10, 25, 80, -20],
                    [100, -20, 50, 25, 25, 50, -20, 100]]
 
+evaluate_table = WeightTable(evaluate_matrix)
+
+# 位置得分由棋盘随走棋增量维护，这里只需要查出来
 def evaluate(reversi: Reversi) -> int:
-    total = 0
-    for y, x in itertools.product(range(reversi.size), repeat=2):
-        if reversi.board[y][x]:
-            total += evaluate_matrix[y][x] if reversi.board[y][x] == 1 else -evaluate_matrix[y][x]
-    return total
+    i = reversi.track(evaluate_table)
+    return reversi.scores[i]
+
+# 每个格子的位置价值，走法排序时使用
+SQUARE_VALUES = [evaluate_matrix[y][x] for y in range(SIZE) for x in range(SIZE)]
 
 DEPTH = 4
+TIME_LIMIT = None # 每步思考的时间上限（秒），和 NODE_LIMIT 都为 None 时固定搜索 DEPTH 层
+NODE_LIMIT = None # 每步思考的搜索节点数上限
+CHECK_INTERVAL = 256 # 每搜索这么多个节点检查一次是否超时
+INFINITY = 10000000
+TABLE_BITS = 18 # 置换表大小为 2 ** TABLE_BITS 项
+# 空格不超过这么多时改为精确求解终局，None 表示不使用
+# 训练环境的对手每步都经过这里：6 个空格时求解比 4 层搜索还快，10 个空格时要慢一个数量级，
+# 所以默认比 agent.Agent 使用的 endgame.EMPTIES 小
+ENDGAME_EMPTIES = 6
+BOOK = BOOK_PATH # 开局库文件，先查开局库再搜索，None 表示不使用
+WORKERS = 1 # 固定深度搜索时使用的进程数，大于 1 时在根节点把走法分给进程池并行搜索
+
+# 置换表中记录的分数类型：精确值、下界（发生了beta剪枝）、上界（没有走法超过alpha）
+EXACT, LOWER, UPPER = 0, 1, 2
+
+class TranspositionTable:
+    # 以 Zobrist 哈希为键的定长置换表，每项为 (哈希, 深度, 类型, 分数, 最佳走法)
+    # 冲突时保留搜索深度更大的一项
+    def __init__(self, bits: int = TABLE_BITS):
+        self.mask = (1 << bits) - 1
+        self.entries = [None] * (1 << bits)
+        self.probes = 0  # 查表次数
+        self.hits = 0    # 命中次数
+        self.cutoffs = 0 # 命中后直接返回、不再搜索的次数
+
+    def probe(self, key: int) -> Optional[Tuple[int, int, int, int, Coordinate]]:
+        self.probes += 1
+        entry = self.entries[key & self.mask]
+        if entry is not None and entry[0] == key:
+            self.hits += 1
+            return entry
+        return None
+
+    def store(self, key: int, depth: int, flag: int, score: int, best: Coordinate):
+        idx = key & self.mask
+        entry = self.entries[idx]
+        if entry is None or entry[0] == key or depth >= entry[1]:
+            self.entries[idx] = (key, depth, flag, score, best)
+
+    def clear(self):
+        self.entries = [None] * (self.mask + 1)
+        self.probes = self.hits = self.cutoffs = 0
+
+    def report(self) -> str:
+        probes = max(self.probes, 1)
+        return 'TT probes: {}, hit rate: {:.2%}, cutoff rate: {:.2%}'.format(
+            self.probes, self.hits / probes, self.cutoffs / probes)
+
+table = TranspositionTable() # 在同一局及相邻几步的搜索之间共享
+
+class SearchTimeout(Exception):
+    # 思考时间或节点数用完，中止本次迭代
+    pass
+
+# 并行搜索的进程池，按进程数分别创建，整个程序中复用
+# 每个进程池带一个共享的界：Max 走棋时为目前最好的分数（alpha），Min 走棋时为 beta
+pools: Dict[int, Tuple[Pool, multiprocessing.Value]] = {}
+bound = None # 进程池中的进程看到的共享界
+
+def initWorker(shared: multiprocessing.Value):
+    global bound
+    bound = shared
+
+def getPool(workers: int) -> Tuple[Pool, multiprocessing.Value]:
+    if workers not in pools:
+        shared = multiprocessing.Value('i', 0)
+        pools[workers] = (Pool(workers, initializer=initWorker, initargs=(shared,)), shared)
+    return pools[workers]
+
+# 结束所有进程池，之后的并行搜索会重新创建（各进程的置换表也随之清空）
+def closePools():
+    for pool, _ in pools.values():
+        pool.terminate()
+    pools.clear()
+
+# 进程池中搜索根节点的一个走法，输入：(黑棋, 白棋, 走棋方, 走法, 深度)；输出：(分数, 节点数, 剪枝数)
+# 窗口取任务开始时的共享界，并放宽 1 分：与目前最好分数相等的走法也能得到准确的分数，
+# 这样才能和单进程搜索一样，在分数相同的走法中选排序最靠前的一个
+def searchMove(arg: Tuple[int, int, int, Coordinate, int]) -> Tuple[int, int, int]:
+    black, white, who, position, depth = arg
+    reversi = Reversi()
+    reversi.load(black, white, who)
+    reversi.place(position, who)
+    Agent.reset() # 分数不依赖这个进程之前搜索过哪些走法
+    Agent.nodes = Agent.cutoffs = 0
+    Agent.checkpoint = float('inf')
+
+    with bound.get_lock():
+        current = bound.value
+    if who == 1:
+        _, score = Agent.search(reversi, 2, current - 1, INFINITY, depth - 1)
+    else:
+        _, score = Agent.search(reversi, 1, -INFINITY, current + 1, depth - 1)
+
+    with bound.get_lock():
+        if (score > bound.value) if who == 1 else (score < bound.value):
+            bound.value = score
+    return score, Agent.nodes, Agent.cutoffs
 
 class Agent:
+    nodes = 0 # 本次思考已搜索的节点数
+    cutoffs = 0 # 本次思考发生 alpha-beta 剪枝的次数
+    reached = 0 # 本次思考完整搜索的深度
+    checkpoint = float('inf') # 搜索到这么多个节点时检查预算
+    deadline = None
+    nodeLimit = None
+    # 杀手走法：按剩余深度记录最近两个引起剪枝的格子；历史启发：按颜色记录每个格子引起剪枝的累计得分
+    killers = [[None, None] for _ in range(SIZE * SIZE + 1)]
+    history = [None, [0] * (SIZE * SIZE), [0] * (SIZE * SIZE)]
+
+    # 不给预算时固定搜索 depth 层，否则在预算内迭代加深，返回最后一次完整迭代的最佳走法
+    # 开局库中有当前局面时直接使用，空格数不超过 endgame 时直接精确求解
     @staticmethod
-    def brain(reversi: Reversi, who: int) -> Coordinate:
-        position, _ = Agent.search(reversi, who, -10000000, 10000000, DEPTH)
-        return position
-    
+    def brain(reversi: Reversi, who: int, timeLimit: Optional[float] = TIME_LIMIT,
+        nodeLimit: Optional[int] = NODE_LIMIT, endgame: Optional[int] = ENDGAME_EMPTIES,
+        book: Optional[str] = BOOK, depth: int = DEPTH, workers: int = WORKERS) -> Coordinate:
+
+        if book is not None and reversi.next == who:
+            position = probe(reversi, book)
+            if position is not None:
+                count('search.book')
+                return position
+
+        if endgame is not None and reversi.next == who and solvable(reversi, endgame):
+            position, _ = solveMove(reversi)
+            return position
+
+        Agent.nodes = Agent.cutoffs = Agent.reached = 0
+        # 进程池中的进程（如训练环境的对手）不能再创建进程池
+        parallel = timeLimit is None and nodeLimit is None and workers > 1 and reversi.next == who \
+            and not multiprocessing.current_process().daemon
+        if parallel:
+            Agent.reset() # 见 split
+        hits, tableCutoffs = table.hits, table.cutoffs
+        # 历史得分逐步衰减，让较早局面的经验淡出
+        Agent.history = [None] + [[h // 2 for h in Agent.history[c]] for c in (1, 2)]
+
+        if timeLimit is None and nodeLimit is None:
+            Agent.checkpoint = float('inf')
+            if parallel:
+                position, _ = Agent.split(reversi, who, depth, workers)
+            else:
+                position, _ = Agent.search(reversi, who, -INFINITY, INFINITY, depth)
+            Agent.reached = depth
+            Agent.record(hits, tableCutoffs)
+            return position
+
+        Agent.deadline = None if timeLimit is None else time.perf_counter() + timeLimit
+        Agent.nodeLimit = nodeLimit
+        Agent.checkpoint = 0
+        played = len(reversi.history)
+
+        best = Agent.order(reversi, who, 0, None)[0] if reversi.next == who else None # 保底走法
+        empty = SIZE * SIZE - reversi.number[1] - reversi.number[2]
+        for depth in range(1, empty + 1):
+            try:
+                position, _ = Agent.search(reversi, who, -INFINITY, INFINITY, depth)
+            except SearchTimeout:
+                # 中止时棋盘停留在搜索中途，悔棋恢复
+                while len(reversi.history) > played:
+                    reversi.unplace()
+                break
+            Agent.reached = depth
+            if position is not None:
+                best = position
+
+        Agent.deadline = Agent.nodeLimit = None
+        Agent.checkpoint = float('inf')
+        Agent.record(hits, tableCutoffs)
+        return best
+
+    # 根节点分割的并行搜索
+    # 先单独搜索排在第一的走法得到一个较紧的界，再把其余走法分给各个进程，每完成一个走法就更新共享界
+    # 置换表中更深的项会直接返回，分数随表的内容变化，而哪个进程搜索哪个走法每次都不同，
+    # 所以 brain 调用前清空本进程的置换表和走法排序信息，各进程搜索每个走法前也各自清空，
+    # 结果只取决于局面和深度，与从空表开始的 search 选出的走法相同
+    # 例外：search 中排在后面的根走法能用到前面走法留下的表项，同一局面经过跳过的回合会以不同的剩余深度出现，
+    # 这时两者的分数可能不同；带着之前置换表的 search（如训练对手连续走棋）与从空表开始的 search 本来也可能不同
+    @staticmethod
+    def split(reversi: Reversi, who: int, depth: int, workers: int) -> Tuple[Coordinate, int]:
+        available = Agent.order(reversi, who, depth, None)
+        pool, shared = getPool(workers)
+        shared.value = -INFINITY if who == 1 else INFINITY
+        args = [(reversi.bitboards[1], reversi.bitboards[2], who, position, depth) for position in available]
+
+        results = [pool.apply(searchMove, (args[0],))]
+        results += pool.map(searchMove, args[1:], chunksize=1)
+        Agent.nodes += 1 + sum(nodes for _, nodes, _ in results)
+        Agent.cutoffs += sum(cutoffs for _, _, cutoffs in results)
+
+        # 分数相同时取排序靠前的走法
+        scores = [score for score, _, _ in results]
+        score = max(scores) if who == 1 else min(scores)
+        return available[scores.index(score)], score
+
+    # 清空置换表和走法排序信息
+    @staticmethod
+    def reset():
+        table.clear()
+        Agent.killers = [[None, None] for _ in range(SIZE * SIZE + 1)]
+        Agent.history = [None, [0] * (SIZE * SIZE), [0] * (SIZE * SIZE)]
+
+    # 记录本次思考的搜索统计，见 instrument.py
+    @staticmethod
+    def record(hits: int, tableCutoffs: int):
+        count('search.calls')
+        count('search.nodes', Agent.nodes)
+        count('search.cutoffs', Agent.cutoffs)
+        count('search.depth', Agent.reached)
+        count('search.tt_hits', table.hits - hits)
+        count('search.tt_cutoffs', table.cutoffs - tableCutoffs)
+
+    # 检查预算是否用完
+    @staticmethod
+    def check():
+        if Agent.nodeLimit is not None and Agent.nodes > Agent.nodeLimit:
+            raise SearchTimeout()
+        if Agent.deadline is not None and time.perf_counter() > Agent.deadline:
+            raise SearchTimeout()
+        Agent.checkpoint = Agent.nodes + CHECK_INTERVAL
+        if Agent.nodeLimit is not None:
+            Agent.checkpoint = min(Agent.checkpoint, Agent.nodeLimit + 1)
+
+    # 走法排序：置换表（上一次迭代）的最佳走法、杀手走法、历史得分加位置价值
+    @staticmethod
+    def order(reversi: Reversi, who: int, depth: int, hint: Optional[Coordinate]) -> List[Coordinate]:
+        killers = Agent.killers[depth]
+        history = Agent.history[who]
+        hint = hint[0] * SIZE + hint[1] if hint is not None else None
+
+        moves = reversi.moves
+        available = []
+        while moves:
+            move = moves & -moves
+            moves ^= move
+            available.append(move.bit_length() - 1)
+
+        def score(square: int) -> int:
+            if square == hint:
+                return 1 << 40
+            elif square == killers[0]:
+                return 1 << 31
+            elif square == killers[1]:
+                return 1 << 30
+            return history[square] + SQUARE_VALUES[square]
+
+        available.sort(key=score, reverse=True)
+        return [divmod(square, SIZE) for square in available]
+
+    # 记录引起剪枝的走法
+    @staticmethod
+    def remember(who: int, depth: int, position: Coordinate):
+        Agent.cutoffs += 1
+        square = position[0] * SIZE + position[1]
+        killers = Agent.killers[depth]
+        if killers[0] != square:
+            killers[1] = killers[0]
+            killers[0] = square
+        Agent.history[who][square] += depth * depth
+
     @staticmethod
     def search(reversi: Reversi, who: int, alpha: int, beta: int, depth: int) -> Tuple[Coordinate, int]:
+        Agent.nodes += 1
+        if Agent.nodes >= Agent.checkpoint:
+            Agent.check()
+
         if depth <= 0 or reversi.next == 0:
             return None, evaluate(reversi)
 
         if reversi.next != who:
-            return Agent.search(reversi, 2 if who == 1 else 2, alpha, beta, depth-1)
+            return Agent.search(reversi, 2 if who == 1 else 1, alpha, beta, depth-1)
+
+        # 查置换表，足够深的记录可以直接返回，否则先尝试记录中的最佳走法
+        key = reversi.hash
+        hint = None
+        entry = table.probe(key)
+        if entry is not None:
+            _, d, flag, score, hint = entry
+            if d >= depth and (flag == EXACT or (flag == LOWER and score >= beta) or (flag == UPPER and score <= alpha)):
+                table.cutoffs += 1
+                return hint, score
 
-        available = [(y, x) for y, x in itertools.product(range(reversi.size), repeat=2) if reversi.good[y][x]]
+        available = Agent.order(reversi, who, depth, hint)
         best = None
 
+        # 在同一个棋盘上走棋、搜索、悔棋
         if who == 1: # Max
             for position in available:
-                reversi_ = deepcopy(reversi)
-                reversi_.place(position, 1)
-                _, score = Agent.search(reversi_, 2, alpha, beta, depth-1)
+                reversi.place(position, 1)
+                _, score = Agent.search(reversi, 2, alpha, beta, depth-1)
+                reversi.unplace()
 
                 if score > alpha: # alpha就是Max能获得的最大效益值
                     alpha = score
                     best = position
                     if alpha >= beta:
+                        table.store(key, depth, LOWER, alpha, best)
+                        Agent.remember(who, depth, best)
                         return None, alpha
 
+            table.store(key, depth, EXACT if best is not None else UPPER, alpha, best)
             return best, alpha
         else: # Min
             for position in available:
-                reversi_ = deepcopy(reversi)
-                reversi_.place(position, 2)
-                _, score = Agent.search(reversi_, 1, alpha, beta, depth-1)
+                reversi.place(position, 2)
+                _, score = Agent.search(reversi, 1, alpha, beta, depth-1)
+                reversi.unplace()
 
                 if score < beta: # beta就是Min能获得的最小效益值
                     beta = score
                     best = position
                     if beta <= alpha:
+                        table.store(key, depth, UPPER, beta, best)
+                        Agent.remember(who, depth, best)
                         return None, beta
 
+            table.store(key, depth, EXACT if best is not None else LOWER, beta, best)
             return best, beta
\ No newline at end of file
@@ -92,3 +92,41 @@ class ActorCritic(nn.Module): # 卷积残差网络
         value = self.critic(F.relu(self.critic_fc(out)))
         policy = F.softmax(self.actor(F.relu(self.actor_fc(out))), dim=-1)
         return value, policy
+
+class Student(nn.Module): # 蒸馏用的小网络：几层窄的 3x3 卷积，策略逐格输出，价值由全局平均得到
+    def __init__(self, planes: int = 32, depth: int = 4):
+        super(Student, self).__init__()
+        self.size = SIZE
+
+        layers = []
+        in_planes = 3
+        for _ in range(depth):
+            layers += [
+                nn.Conv2d(in_planes, planes, kernel_size=3, stride=1, padding=1, bias=False),
+                nn.BatchNorm2d(planes),
+                nn.ReLU(inplace=True),
+            ]
+            in_planes = planes
+        self.layers = nn.Sequential(*layers)
+
+        self.critic_fc = nn.Linear(planes, 64)
+        self.critic = nn.Linear(64, 1)
+        self.actor = nn.Conv2d(planes, 1, kernel_size=1)
+
+    def forward(self, states: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+        out = self.layers(states)
+        pooled = F.adaptive_avg_pool2d(out, (1, 1)).view(out.size(0), -1)
+        value = self.critic(F.relu(self.critic_fc(pooled)))
+        policy = F.softmax(self.actor(out).view(out.size(0), -1), dim=-1)
+        return value, policy
+
+# 载入检查点，按参数名区分 ActorCritic 和 Student，Student 的宽度和层数由参数形状得到
+def loadNet(path: str) -> nn.Module:
+    state = torch.load(path, map_location='cpu')
+    if 'layers.0.weight' in state:
+        convs = [key for key, value in state.items() if key.startswith('layers.') and value.dim() == 4]
+        net = Student(state['layers.0.weight'].size(0), len(convs))
+    else:
+        net = ActorCritic()
+    net.load_state_dict(state)
+    return net
@@ -0,0 +1,133 @@
+from typing import List, Optional, Tuple
+
+import mmap
+import os
+import struct
+import torch
+from reversi import SIZE
+from env import SARSD
+from vecenv import batchStates
+
+# 回放存储：把自对弈的样本压缩成定长记录存进内存映射文件，可以跨回合、跨进程重复使用
+# 文件头 HEADER 字节：魔数、容量、样本数、下一个写入位置；之后每条记录 RECORD 字节：
+#   0-7 黑棋位棋盘 | 8-15 白棋位棋盘 | 16-19 Return (float32) | 20-23 优先级 (float32)
+#   24 轮到谁 | 25 动作编号 | 26 是否结束 | 27-31 保留
+# 写满后从最早的样本开始覆盖（先进先出）
+
+MAGIC = b'RVREPLAY'
+HEADER = 64
+RECORD = 32
+HEADER_FORMAT = '<8sqqq' # 魔数、容量、样本数、下一个写入位置
+
+BIT_INDEX = torch.arange(SIZE * SIZE)
+
+# 把 (N, SIZE, SIZE) 的 0/1 平面压缩成 int64 位棋盘
+def packPlanes(planes: torch.Tensor) -> torch.Tensor:
+    return ((planes.reshape(-1, SIZE * SIZE).long() != 0).long() << BIT_INDEX).sum(dim=-1)
+
+class ReplayStore:
+    def __init__(self, path: str, capacity: int):
+        exists = os.path.exists(path)
+        self.file = open(path, 'r+b' if exists else 'w+b')
+
+        if exists:
+            magic, capacity, self.size, self.head = struct.unpack_from(HEADER_FORMAT, self.file.read(HEADER))
+            if magic != MAGIC:
+                raise Exception('{} is not a replay file'.format(path))
+        else:
+            self.size, self.head = 0, 0
+            self.file.truncate(HEADER + capacity * RECORD)
+
+        self.capacity = capacity
+        self.mmap = mmap.mmap(self.file.fileno(), HEADER + capacity * RECORD)
+        self.records = torch.frombuffer(self.mmap, dtype=torch.uint8, offset=HEADER).view(capacity, RECORD)
+        self.writeHeader()
+
+    def writeHeader(self):
+        struct.pack_into(HEADER_FORMAT, self.mmap, 0, MAGIC, self.capacity, self.size, self.head)
+
+    def __len__(self) -> int:
+        return self.size
+
+    # 追加一批样本，black/white 为 int64 位棋盘，next 为轮到谁（1 或 2）
+    def extend(self, black: torch.Tensor, white: torch.Tensor, next: torch.Tensor, actions: torch.Tensor,
+        Returns: torch.Tensor, done: torch.Tensor, priorities: Optional[torch.Tensor] = None):
+
+        n = len(black)
+        if n == 0:
+            return
+        if priorities is None:
+            # 新样本用当前最大的优先级，保证至少被采样到一次
+            priorities = torch.full((n,), max(self.priorities().max().item(), 1.) if self.size else 1.)
+
+        rows = torch.zeros(n, RECORD, dtype=torch.uint8)
+        rows[:, 0:8] = black.to(torch.int64).contiguous().view(torch.uint8).view(n, 8)
+        rows[:, 8:16] = white.to(torch.int64).contiguous().view(torch.uint8).view(n, 8)
+        rows[:, 16:20] = Returns.to(torch.float32).contiguous().view(torch.uint8).view(n, 4)
+        rows[:, 20:24] = priorities.to(torch.float32).contiguous().view(torch.uint8).view(n, 4)
+        rows[:, 24] = next.to(torch.uint8)
+        rows[:, 25] = actions.to(torch.uint8)
+        rows[:, 26] = done.to(torch.uint8)
+
+        # 只保留最后 capacity 条，环形写入
+        rows = rows[-self.capacity:]
+        n = len(rows)
+        first = min(n, self.capacity - self.head)
+        self.records[self.head:self.head + first] = rows[:first]
+        self.records[:n - first] = rows[first:]
+        self.head = (self.head + n) % self.capacity
+        self.size = min(self.size + n, self.capacity)
+        self.writeHeader()
+
+    # 追加 Envs.readHistory() 格式的样本
+    def append(self, data: List[SARSD]):
+        if not data:
+            return
+        states = torch.stack([s for s, _, _, _, _ in data])
+        self.extend(
+            packPlanes(states[:, 0]),
+            packPlanes(states[:, 1]),
+            2 - states[:, 2, 0, 0].long(),
+            torch.tensor([y * SIZE + x for _, (y, x), _, _, _ in data]),
+            torch.tensor([R for _, _, R, _, _ in data]),
+            torch.tensor([bool(d) for _, _, _, _, d in data])
+        )
+
+    def column(self, start: int, end: int, dtype: torch.dtype, idx: Optional[torch.Tensor] = None) -> torch.Tensor:
+        rows = self.records[:self.size] if idx is None else self.records[idx]
+        return rows[:, start:end].contiguous().view(dtype).view(-1)
+
+    def priorities(self) -> torch.Tensor:
+        return self.column(20, 24, torch.float32)
+
+    # 更新样本的优先级（例如用 TD 误差的绝对值）
+    def update(self, idx: torch.Tensor, priorities: torch.Tensor):
+        self.records[idx, 20:24] = priorities.to(torch.float32).contiguous().view(torch.uint8).view(-1, 4)
+
+    # 采样一个 batch，alpha 为 0 时均匀采样，否则按优先级的 alpha 次方成比例采样
+    # 返回：状态 (B, 3, SIZE, SIZE)、动作、Return、是否结束、样本下标
+    def sample(self, batch_size: int, alpha: float = 0.) -> Tuple[torch.Tensor, ...]:
+        if self.size == 0:
+            raise Exception('Replay store is empty')
+        if alpha == 0.:
+            idx = torch.randint(self.size, (batch_size,))
+        else:
+            idx = torch.multinomial(self.priorities().clamp(min=1e-6) ** alpha, batch_size, replacement=True)
+
+        rows = self.records[idx]
+        black = rows[:, 0:8].contiguous().view(torch.int64).view(-1)
+        white = rows[:, 8:16].contiguous().view(torch.int64).view(-1)
+        Returns = rows[:, 16:20].contiguous().view(torch.float32).view(-1)
+        next = rows[:, 24].long()
+        actions = rows[:, 25].long()
+        done = rows[:, 26].bool()
+        return batchStates(black, white, next), actions, Returns, done, idx
+
+    def flush(self):
+        self.mmap.flush()
+
+    def close(self):
+        self.flush()
+        del self.records
+        self.mmap.close()
+        self.file.close()
@@ -0,0 +1,116 @@
+from typing import Optional
+
+import torch
+import torch.multiprocessing as mp
+from reversi import Coordinate, Reversi, SIZE
+from minimax import Agent as Minimax # Minimax Agent
+from symmetry import SOURCES, TARGETS
+from book import canonical
+import instrument
+
+# 训练时 Minimax 对手的应对缓存：所有棋盘都从同样的两个开局出发，前几步的局面在各个进程、各个回合中反复出现
+# 以 8 种对称中的规范形式 (黑棋, 白棋, 轮到谁) 为键，记录 Minimax 在规范方向上的应对
+# 表放在共享内存中，要在创建进程池、常驻进程之前 enable，之后 fork 出的子进程共用同一张表
+# 组相联：每个键只能放在所在组的 WAYS 项中，组满时淘汰最久没有用到的一项（LRU）
+# 缓存的应对是默认参数下 Minimax.brain 的结果，搜索参数不同的调用不要经过缓存
+# 缓存的是第一次遇到这个局面时算出的应对，不是唯一确定的答案：Minimax 的置换表在同一进程的各次搜索之间保留，
+# 表中更深的项会改变分数，不经过缓存时同一局面在不同时候、不同进程中可能得到不同的应对
+
+CAPACITY = 1 << 16 # 缓存的局面数
+WAYS = 4 # 每组的项数
+# 每项的列：黑棋、白棋、(应对格子 + 1) << 2 | 轮到谁（0 表示空项）、最近一次使用的时间
+BLACK, WHITE, INFO, STAMP = range(4)
+HITS, MISSES, EVICTIONS = range(3)
+
+# 转为 int64 能保存的有符号数（vecenv.toSigned 的副本，vecenv 依赖本模块）
+def toSigned(bits: int) -> int:
+    return bits - (1 << 64) if bits >> 63 else bits
+
+class ReplyCache:
+    def __init__(self, capacity: int = CAPACITY):
+        self.sets = max(capacity // WAYS, 1)
+        self.entries = torch.zeros(self.sets, WAYS, 4, dtype=torch.int64).share_memory_()
+        self.stats = torch.zeros(3, dtype=torch.int64).share_memory_() # 所有进程合计的命中、未命中、淘汰次数
+        self.clock = torch.zeros(1, dtype=torch.int64).share_memory_()
+        self.lock = mp.Lock()
+
+    def index(self, black: int, white: int, next: int) -> int:
+        key = (black * 0x9E3779B97F4A7C15) ^ (white * 0xC2B2AE3D27D4EB4F) ^ next
+        return (key >> 17) % self.sets
+
+    def tick(self) -> int:
+        self.clock[0] += 1
+        return self.clock[0].item()
+
+    # 输入规范形式的局面，返回规范方向上的应对格子，没有时返回 None
+    def probe(self, black: int, white: int, next: int) -> Optional[int]:
+        i = self.index(black, white, next)
+        black, white = toSigned(black), toSigned(white)
+        with self.lock:
+            for way, (b, w, info, _) in enumerate(self.entries[i].tolist()):
+                if info and b == black and w == white and info & 3 == next:
+                    self.entries[i, way, STAMP] = self.tick()
+                    self.stats[HITS] += 1
+                    return (info >> 2) - 1
+            self.stats[MISSES] += 1
+        return None
+
+    def store(self, black: int, white: int, next: int, square: int):
+        i = self.index(black, white, next)
+        black, white = toSigned(black), toSigned(white)
+        with self.lock:
+            entries = self.entries[i].tolist()
+            found = False
+            for way, (b, w, info, _) in enumerate(entries):
+                if info and b == black and w == white and info & 3 == next:
+                    found = True # 其他进程已经存入，覆盖同一项
+                    break
+            if not found:
+                way = min(range(WAYS), key=lambda j: entries[j][STAMP]) # 空项的时间为 0，最先使用
+                if entries[way][INFO]:
+                    self.stats[EVICTIONS] += 1
+            self.entries[i, way] = torch.tensor([black, white, (square + 1) << 2 | next, self.tick()])
+
+    def clear(self):
+        with self.lock:
+            self.entries.zero_()
+            self.stats.zero_()
+            self.clock.zero_()
+
+    def report(self) -> str:
+        hits, misses, evictions = self.stats.tolist()
+        return 'Reply cache probes: {}, hit rate: {:.2%}, evictions: {}'.format(
+            hits + misses, hits / max(hits + misses, 1), evictions)
+
+cache: Optional[ReplyCache] = None
+
+# 打开缓存，要在创建子进程之前调用
+def enable(capacity: int = CAPACITY) -> ReplyCache:
+    global cache
+    cache = ReplyCache(capacity)
+    return cache
+
+# 所有进程合计的命中率，未打开缓存时为空
+def summary() -> dict:
+    if cache is None:
+        return {}
+    hits, misses, evictions = cache.stats.tolist()
+    return {'replies.hit_rate': hits / max(hits + misses, 1), 'replies.evictions': evictions}
+
+# Minimax 对手的应对，打开缓存时先查缓存
+def reply(reversi: Reversi, who: int) -> Coordinate:
+    if cache is None:
+        return Minimax.brain(reversi, who)
+
+    black, white, k = canonical(reversi.bitboards[1], reversi.bitboards[2])
+    square = cache.probe(black, white, who)
+    if square is not None:
+        square = SOURCES[k][square] # 变换回原来的方向
+        if reversi.moves >> square & 1:
+            instrument.count('replies.hits')
+            return divmod(square, SIZE)
+
+    instrument.count('replies.misses')
+    y, x = Minimax.brain(reversi, who)
+    cache.store(black, white, who, TARGETS[k][y * SIZE + x])
+    return y, x
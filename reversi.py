@@ -1,126 +1,313 @@
-from typing import Tuple
+from typing import Iterator, List, Tuple
 
-import itertools
+import random
 
 Coordinate = Tuple[int, int]
 SIZE = 8
 
+# 位棋盘：棋盘第 y 行第 x 列对应整数的第 y * SIZE + x 位
+FULL = (1 << (SIZE * SIZE)) - 1
+COLUMN_FIRST = sum(1 << (y * SIZE) for y in range(SIZE))
+COLUMN_LAST = COLUMN_FIRST << (SIZE - 1)
+NOT_COLUMN_FIRST = FULL ^ COLUMN_FIRST
+NOT_COLUMN_LAST = FULL ^ COLUMN_LAST
+
+# 8 个方向的移位量以及移位后需要去掉的越界列
+# 左移（位序号增大）：右、下、右下、左下；右移（位序号减小）：左、上、左上、右上
+LEFT_SHIFTS = [(1, NOT_COLUMN_FIRST), (SIZE, FULL), (SIZE + 1, NOT_COLUMN_FIRST), (SIZE - 1, NOT_COLUMN_LAST)]
+RIGHT_SHIFTS = [(1, NOT_COLUMN_LAST), (SIZE, FULL), (SIZE + 1, NOT_COLUMN_LAST), (SIZE - 1, NOT_COLUMN_FIRST)]
+
+# 每个格子沿 8 个方向的射线（不含该格子本身），分为位序号递增和递减两组
+def makeRays(y: int, x: int, directions: List[Coordinate]) -> Tuple[int, ...]:
+    rays = []
+    for dy, dx in directions:
+        ray = 0
+        yy, xx = y + dy, x + dx
+        while 0 <= yy < SIZE and 0 <= xx < SIZE:
+            ray |= 1 << (yy * SIZE + xx)
+            yy, xx = yy + dy, xx + dx
+        rays.append(ray)
+    return tuple(rays)
+
+RAYS_UP = [makeRays(y, x, [(0, 1), (1, 0), (1, 1), (1, -1)]) for y in range(SIZE) for x in range(SIZE)]
+RAYS_DOWN = [makeRays(y, x, [(0, -1), (-1, 0), (-1, -1), (-1, 1)]) for y in range(SIZE) for x in range(SIZE)]
+
+# Zobrist 哈希的随机数表：ZOBRIST[颜色][格子]，以及轮到哪方走棋（0 表示对局结束）
+# 固定随机种子，保证不同进程算出的哈希值一致
+zobristRandom = random.Random(20211)
+ZOBRIST = [[0] * (SIZE * SIZE)] + [[zobristRandom.getrandbits(64) for _ in range(SIZE * SIZE)] for _ in range(2)]
+ZOBRIST_FLIP = [ZOBRIST[1][i] ^ ZOBRIST[2][i] for i in range(SIZE * SIZE)] # 翻转一颗棋子时的哈希变化
+ZOBRIST_NEXT = [zobristRandom.getrandbits(64) for _ in range(3)]
+
+# 从头计算棋盘的 Zobrist 哈希值
+def getHash(black: int, white: int, next: int) -> int:
+    h = ZOBRIST_NEXT[next]
+    for i in range(SIZE * SIZE):
+        if black >> i & 1:
+            h ^= ZOBRIST[1][i]
+        elif white >> i & 1:
+            h ^= ZOBRIST[2][i]
+    return h
+
+# 由位棋盘的一行（SIZE 位）查表得到该行的元组表示，供 good 和 board 视图使用
+ROW_BITS = [tuple(bool(row >> x & 1) for x in range(SIZE)) for row in range(1 << SIZE)]
+ROW_TERNARY = [sum(3 ** x for x in range(SIZE) if row >> x & 1) for row in range(1 << SIZE)]
+ROW_CELLS = [tuple(code // 3 ** x % 3 for x in range(SIZE)) for code in range(3 ** SIZE)]
+ROW_MASK = (1 << SIZE) - 1
+
+# 计算己方在位棋盘上所有可以下棋的位置
+def getMoves(own: int, opp: int) -> int:
+    empty = FULL ^ (own | opp)
+    moves = 0
+    for d, mask in LEFT_SHIFTS:
+        m = opp & mask
+        t = (own << d) & m
+        for _ in range(SIZE - 3):
+            t |= (t << d) & m
+        moves |= (t << d) & mask & empty
+    for d, mask in RIGHT_SHIFTS:
+        m = opp & mask
+        t = (own >> d) & m
+        for _ in range(SIZE - 3):
+            t |= (t >> d) & m
+        moves |= (t >> d) & mask & empty
+    return moves
+
+# 判断己方是否至少有一个可以下棋的位置，找到一个就返回
+def hasMoves(own: int, opp: int) -> bool:
+    empty = FULL ^ (own | opp)
+    for d, mask in LEFT_SHIFTS:
+        m = opp & mask
+        t = (own << d) & m
+        for _ in range(SIZE - 3):
+            t |= (t << d) & m
+        if (t << d) & mask & empty:
+            return True
+    for d, mask in RIGHT_SHIFTS:
+        m = opp & mask
+        t = (own >> d) & m
+        for _ in range(SIZE - 3):
+            t |= (t >> d) & m
+        if (t >> d) & mask & empty:
+            return True
+    return False
+
+# 计算己方在第 square 格下棋后被翻转的敌方棋子
+# 沿每条射线找到第一个不是敌方棋子的格子，若是己方棋子则中间的敌方棋子全部翻转
+def getFlips(own: int, opp: int, square: int) -> int:
+    flips = 0
+    for ray in RAYS_UP[square]:
+        blocker = ray & ~opp
+        blocker &= -blocker # 位序号最小的一个
+        if blocker & own:
+            flips |= ray & (blocker - 1)
+    for ray in RAYS_DOWN[square]:
+        blocker = ray & ~opp
+        if blocker:
+            blocker = 1 << (blocker.bit_length() - 1) # 位序号最大的一个
+            if blocker & own:
+                flips |= ray & -(blocker << 1)
+    return flips
+
+class GoodView():
+    # 以 good[y][x] 的形式只读访问可下棋位置
+    def __init__(self, reversi: 'Reversi'):
+        self.reversi = reversi
+
+    def __getitem__(self, y: int) -> Tuple[bool, ...]:
+        return ROW_BITS[(self.reversi.moves >> (y * SIZE)) & ROW_MASK]
+
+    def __len__(self) -> int:
+        return SIZE
+
+    def __iter__(self) -> Iterator[Tuple[bool, ...]]:
+        return (self[y] for y in range(SIZE))
+
+class BoardView():
+    # 以 board[y][x] 的形式只读访问棋盘，0 为空，1 为黑棋，2 为白棋
+    def __init__(self, reversi: 'Reversi'):
+        self.reversi = reversi
+
+    def __getitem__(self, y: int) -> Tuple[int, ...]:
+        shift = y * SIZE
+        bitboards = self.reversi.bitboards
+        return ROW_CELLS[ROW_TERNARY[(bitboards[1] >> shift) & ROW_MASK] + 2 * ROW_TERNARY[(bitboards[2] >> shift) & ROW_MASK]]
+
+    def __len__(self) -> int:
+        return SIZE
+
+    def __iter__(self) -> Iterator[Tuple[int, ...]]:
+        return (self[y] for y in range(SIZE))
+
+class WeightTable():
+    # 线性权重表，局面得分 = 黑棋所在格子的权重和 - 白棋所在格子的权重和
+    # 被 Reversi.track 登记后，得分随 place 增量更新
+    def __init__(self, matrix: List[List[int]]):
+        self.weights = tuple(matrix[y][x] for y in range(SIZE) for x in range(SIZE))
+        self.flips = tuple(2 * w for w in self.weights) # 翻转一颗棋子时得分变化量的绝对值
+
+    # 从头计算得分
+    def evaluate(self, black: int, white: int) -> int:
+        total = 0
+        for i in range(SIZE * SIZE):
+            if black >> i & 1:
+                total += self.weights[i]
+            elif white >> i & 1:
+                total -= self.weights[i]
+        return total
+
+    # 权重表不会被修改，复制棋盘时共用同一个对象
+    def __deepcopy__(self, memo: dict) -> 'WeightTable':
+        return self
+
 class Reversi():
     def __init__(self):
         self.size = SIZE
-        self.board = [[0 for _ in range(SIZE)] for _ in range(SIZE)]
 
-        # 初始时棋盘上有四颗棋子
+        # 初始时棋盘上有四颗棋子，bitboards[1] 为黑棋，bitboards[2] 为白棋
         ii = SIZE // 2
-        self.board[ii - 1][ii] = 1
-        self.board[ii][ii - 1] = 1
-        self.board[ii - 1][ii - 1] = 2
-        self.board[ii][ii] = 2
+        black = (1 << ((ii - 1) * SIZE + ii)) | (1 << (ii * SIZE + ii - 1))
+        white = (1 << ((ii - 1) * SIZE + ii - 1)) | (1 << (ii * SIZE + ii))
+        self.bitboards = [0, black, white]
+        self.board = BoardView(self)
 
         self.number = {1: 2, 2: 2} # 各棋子个数
-        
+
         self.next = 1 # 轮到哪个颜色
-        self.good = [[False for _ in range(SIZE)] for _ in range(SIZE)]
+        self.mobility = None # 可下棋位置的位棋盘，用到时才计算
+        self.good = GoodView(self)
         self.analyse()
 
         self.recent = None # 记录最近一个棋子的位置
-    
+        self.hash = getHash(black, white, self.next) # Zobrist 哈希值，随 place 增量更新
+        self.history = [] # 悔棋记录，每次 place 成功时压入走棋前的状态，供 unplace 恢复
+
+        self.tables = [] # 登记过的线性权重表
+        self.scores = () # 各权重表当前的得分，每次 place 整体替换，因此悔棋记录可以直接引用旧值
+
     def place(self, postion: Coordinate, player: int) -> str:
         y, x = postion
 
-        if player != self.next or y < 0 or y >= self.size or x < 0 or x >= self.size or not self.good[y][x]:
+        if player != self.next or y < 0 or y >= self.size or x < 0 or x >= self.size:
+            return 'no'
+
+        square = y * SIZE + x
+        move = 1 << square
+        if not self.moves & move:
             return 'no'
-        
+
         a = player  # 己方编号
         b = 2 if a == 1 else 1 # 敌方编号
 
-        self.board[y][x] = a
-        self.recent = (y, x)
-        self.number[a] += 1
+        self.history.append((self.bitboards[1], self.bitboards[2], self.number[1], self.number[2],
+            self.next, self.mobility, self.recent, self.hash, self.scores))
 
         # 进行颜色翻转
-        for dy, dx in [(-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1)]:
-            yy, xx = y + dy, x + dx
-            if yy < 0 or yy >= self.size or xx < 0 or xx >= self.size or self.board[yy][xx] != b:
-                continue
+        flips = getFlips(self.bitboards[a], self.bitboards[b], square)
+        self.bitboards[a] |= move | flips
+        self.bitboards[b] ^= flips
+        self.recent = (y, x)
+
+        count = flips.bit_count()
+        self.number[a] += count + 1
+        self.number[b] -= count
+
+        # 增量更新哈希值和权重表得分：新下的棋子和被翻转的棋子
+        h = self.hash ^ ZOBRIST[a][square] ^ ZOBRIST_NEXT[a]
+        flipped = []
+        while flips:
+            bit = flips & -flips
+            flipped.append(bit.bit_length() - 1)
+            flips ^= bit
+        for i in flipped:
+            h ^= ZOBRIST_FLIP[i]
+        if self.tables:
+            sign = 1 if a == 1 else -1
+            self.scores = tuple(score + sign * (table.weights[square] + sum(table.flips[i] for i in flipped))
+                for table, score in zip(self.tables, self.scores))
 
-            yy, xx = yy + dy, xx + dx
-            while 0 <= yy and yy < self.size and 0 <= xx and xx < self.size:
-                if self.board[yy][xx] == a:
-                    # 将(y, x)到(yy, xx)之前的棋全部翻转颜色
-                    yyy, xxx = y + dy, x + dx
-                    while (yyy, xxx) != (yy, xx):
-                        self.board[yyy][xxx] = a
-                        self.number[a] += 1
-                        self.number[b] -= 1
-                        yyy, xxx = yyy + dy, xxx + dx
-                    break
-                elif not self.board[yy][xx]:
-                    break
-                yy, xx = yy + dy, xx + dx
-        
         # number[a]一定不是0，不需要判断
         if self.number[b] == 0:
             # 一方全部棋子被翻转，则另一方获胜
             self.next = 0
-            return f'end {a}'
+            self.mobility = 0
+            status = f'end {a}'
         elif self.number[a] + self.number[b] == self.size * self.size:
             # 棋盘已下满，进行结算
             self.next = 0
-            return f'end {a}' if self.number[a] > self.number[b] else\
+            self.mobility = 0
+            status = f'end {a}' if self.number[a] > self.number[b] else\
                 ('end 0' if self.number[a] == self.number[b] else f'end {b}')
+        else:
+            self.next = b
+            # 分析可下棋位置
+            self.analyse()
 
-        self.next = 2 if player == 1 else 1
-        # 分析可下棋位置
-        self.analyse()
+            if self.next == 0:
+                # 说明双方均无位置可以下，进行结算
+                status = f'end {a}' if self.number[a] > self.number[b] else\
+                    ('end 0' if self.number[a] == self.number[b] else f'end {b}')
+            else:
+                status = 'ok'
 
-        if self.next == 0:
-            # 说明双方均无位置可以下，进行结算
-            return f'end {a}' if self.number[a] > self.number[b] else\
-                ('end 0' if self.number[a] == self.number[b] else f'end {b}')
+        self.hash = h ^ ZOBRIST_NEXT[self.next]
+        return status
+
+    # 直接设置局面，next 须为实际轮到的一方（对局已结束则为 0），悔棋记录会被清空
+    # 用于从位棋盘还原棋盘，例如批量环境把局面交给 Minimax 搜索时
+    def load(self, black: int, white: int, next: int):
+        self.bitboards = [0, black, white]
+        self.number = {1: black.bit_count(), 2: white.bit_count()}
+        self.next = next
+        self.mobility = None if next else 0
+        self.recent = None
+        self.hash = getHash(black, white, next)
+        self.history = []
+        self.scores = tuple(table.evaluate(black, white) for table in self.tables)
 
-        return 'ok'
-    
-    # 分析可以下棋的位置
+    # 撤销最近一次成功的 place，搜索时在同一个棋盘上走棋和悔棋，不再需要复制棋盘
+    def unplace(self):
+        black, white, self.number[1], self.number[2], self.next, self.mobility, self.recent, self.hash, self.scores = self.history.pop()
+        self.bitboards[1] = black
+        self.bitboards[2] = white
+
+    # 登记一张线性权重表，返回其得分在 scores 中的下标
+    # 已登记过（包括棋盘在进程间传递后得到的等价副本）则直接返回原下标
+    def track(self, table: WeightTable) -> int:
+        for i, t in enumerate(self.tables):
+            if t is table:
+                return i
+            if t.weights == table.weights:
+                self.tables[i] = table
+                return i
+
+        self.tables.append(table)
+        self.scores += (table.evaluate(self.bitboards[1], self.bitboards[2]),)
+        # 悔棋记录里也补上这张表的得分
+        self.history = [record[:-1] + (record[-1] + (table.evaluate(record[0], record[1]),),) for record in self.history]
+        return len(self.tables) - 1
+
+    # 可以下棋位置的位棋盘
+    @property
+    def moves(self) -> int:
+        if self.mobility is None:
+            self.mobility = getMoves(self.bitboards[self.next], self.bitboards[2 if self.next == 1 else 1])
+        return self.mobility
+
+    # 分析轮到哪一方下棋，只判断是否有位置可下，具体位置到 moves 被访问时才计算
+    # 搜索树的叶子节点不会访问 moves，因此省去了大部分完整的走法生成
     def analyse(self, reEnter: bool = False):
         a = self.next   # 己方编号
         b = 2 if a == 1 else 1 # 敌方编号
 
-        movable = False # 是否至少有一个可以下的位置
-
-        for y, x in itertools.product(range(self.size), repeat=2):
-            if self.board[y][x]:
-                self.good[y][x] = False
-                continue
-
-            marked = False
-
-            for dy, dx in [(-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1)]:
-                yy, xx = y + dy, x + dx
-                if yy < 0 or yy >= self.size or xx < 0 or xx >= self.size or self.board[yy][xx] != b:
-                    continue
-
-                yy, xx = yy + dy, xx + dx
-                while 0 <= yy and yy < self.size and 0 <= xx and xx < self.size:
-                    if self.board[yy][xx] == a:
-                        self.good[y][x] = True
-                        marked = True
-                        movable = True
-                        break
-                    elif not self.board[yy][xx]:
-                        break
-                    yy, xx = yy + dy, xx + dx
-                if marked:
-                    break
-            
-            if not marked:
-                self.good[y][x] = False
-        
-        if not movable:
+        self.mobility = None
+
+        if not hasMoves(self.bitboards[a], self.bitboards[b]):
             if not reEnter:
                 # 一个可以下的位置都没有，轮到另一方下棋
                 self.next = b
                 self.analyse(True)
             else:
                 # 双方都没有位置下棋，准备进行结算
-                self.next = 0
\ No newline at end of file
+                self.next = 0
+                self.mobility = 0
@@ -0,0 +1,202 @@
+from typing import Dict, List, Optional, Tuple, Union
+
+import json
+import queue
+import socket
+import socketserver
+import threading
+import time
+import torch
+from reversi import Coordinate, Reversi, SIZE
+from model import loadNet
+from vecenv import batchLegal, batchStates, toSigned
+
+# 本地走棋服务：多个对局（评估、多个 GUI、分析任务）把局面发给同一个服务进程，
+# 服务在一个很短的时间窗口内攒齐等待中的局面，合成一个 batch 做一次前向计算
+# 协议为每行一个 JSON：{"black": 黑棋位棋盘, "white": 白棋位棋盘, "next": 轮到谁} -> {"move": [y, x]}
+# 发送 {"stats": true} 返回队列长度和 batch 大小统计
+# 请求不合法或计算出错时返回 {"error": 说明}
+
+MODEL_PATH = 'models/good.pt'
+ADDRESS = ('127.0.0.1', 7878) # 元组表示本机 TCP 地址，字符串表示 Unix socket 路径
+WINDOW = 0.002 # 收到第一个局面后最多再等待多少秒来攒 batch
+MAX_BATCH = 256
+
+Address = Union[Tuple[str, int], str]
+
+class Request:
+    # 一个等待计算的局面
+    def __init__(self, black: int, white: int, next: int):
+        self.black = black
+        self.white = white
+        self.next = next
+        self.action = -1
+        self.error: Optional[str] = None
+        self.done = threading.Event()
+
+# 检查请求中的局面，合法时返回 None，否则返回错误说明
+def validate(message: dict) -> Optional[str]:
+    black, white, next = message.get('black'), message.get('white'), message.get('next')
+    for name, bits in (('black', black), ('white', white)):
+        if type(bits) is not int or not 0 <= bits < 1 << (SIZE * SIZE):
+            return '{} must be an integer in [0, 2**{})'.format(name, SIZE * SIZE)
+    if black & white:
+        return 'black and white overlap'
+    if next not in (1, 2) or type(next) is not int:
+        return 'next must be 1 or 2'
+    reversi = Reversi()
+    reversi.load(black, white, next)
+    if not reversi.moves:
+        return 'no legal moves for next'
+    return None
+
+class Handler(socketserver.StreamRequestHandler):
+    # 每个客户端连接一个线程，逐行读取请求，提交给 MoveServer 后等待结果
+    def handle(self):
+        manager: MoveServer = self.server.manager
+        for line in self.rfile:
+            try:
+                message = json.loads(line)
+            except ValueError:
+                message = None
+            if not isinstance(message, dict):
+                reply = {'error': 'request must be a JSON object'}
+            elif message.get('stats'):
+                reply = manager.stats()
+            else:
+                error = validate(message)
+                if error is None:
+                    request = Request(message['black'], message['white'], message['next'])
+                    manager.queue.put(request)
+                    request.done.wait()
+                    error = request.error
+                if error is None:
+                    reply = {'move': [request.action // SIZE, request.action % SIZE]}
+                else:
+                    reply = {'error': error}
+            self.wfile.write((json.dumps(reply) + '\n').encode())
+
+class ThreadingTCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+if hasattr(socketserver, 'UnixStreamServer'):
+    class ThreadingUnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+        daemon_threads = True
+
+class MoveServer:
+    def __init__(self, net: torch.nn.Module, address: Address = ADDRESS, window: float = WINDOW, max_batch: int = MAX_BATCH):
+        self.net = net
+        self.net.eval()
+        self.window = window
+        self.max_batch = max_batch
+        self.queue = queue.Queue()
+
+        # 统计
+        self.requests = 0
+        self.batches = 0
+        self.largest = 0
+        self.histogram: Dict[int, int] = {} # batch 大小 -> 次数
+
+        server_class = ThreadingUnixServer if isinstance(address, str) else ThreadingTCPServer
+        self.server = server_class(address, Handler)
+        self.server.manager = self
+
+    # 启动 batch 计算线程并开始接受连接，阻塞直到 shutdown
+    def serve(self):
+        threading.Thread(target=self.loop, daemon=True).start()
+        self.server.serve_forever()
+
+    def shutdown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    # 攒 batch：阻塞等待第一个局面，然后在时间窗口内尽量多收集
+    def loop(self):
+        with torch.no_grad():
+            while True:
+                pending = [self.queue.get()]
+                deadline = time.perf_counter() + self.window
+                while len(pending) < self.max_batch:
+                    timeout = deadline - time.perf_counter()
+                    if timeout <= 0:
+                        break
+                    try:
+                        pending.append(self.queue.get(timeout=timeout))
+                    except queue.Empty:
+                        break
+                # 计算出错时这一批请求都返回错误，线程继续处理后面的请求
+                try:
+                    self.run(pending)
+                except Exception as e:
+                    for request in pending:
+                        if not request.done.is_set():
+                            request.error = '{}: {}'.format(type(e).__name__, e)
+                            request.done.set()
+
+    # 对一个 batch 做前向计算，不能下的位置概率填 0 后取概率最大的位置
+    def run(self, pending: List[Request]):
+        black = torch.tensor([toSigned(r.black) for r in pending], dtype=torch.int64)
+        white = torch.tensor([toSigned(r.white) for r in pending], dtype=torch.int64)
+        next = torch.tensor([r.next for r in pending], dtype=torch.int64)
+
+        _, policy = self.net(batchStates(black, white, next))
+        legal = batchLegal(black, white, next)
+        policy = torch.where(legal, policy + 1e-8, 0.) # 防止概率全为 0
+        actions = policy.max(dim=-1).indices.tolist()
+
+        self.requests += len(pending)
+        self.batches += 1
+        self.largest = max(self.largest, len(pending))
+        self.histogram[len(pending)] = self.histogram.get(len(pending), 0) + 1
+
+        for request, action in zip(pending, actions):
+            request.action = action
+            request.done.set()
+
+    def stats(self) -> dict:
+        return {
+            'queue': self.queue.qsize(),
+            'requests': self.requests,
+            'batches': self.batches,
+            'mean_batch': self.requests / max(self.batches, 1),
+            'max_batch': self.largest,
+            'histogram': self.histogram,
+        }
+
+class Client:
+    # 走棋服务的客户端，brain 与 agent.Agent.brain 的接口相同
+    def __init__(self, address: Address = ADDRESS):
+        if isinstance(address, str):
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.sock.connect(address)
+        else:
+            self.sock = socket.create_connection(address)
+            self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1) # 请求很小，不等待合并发送
+        self.file = self.sock.makefile('rwb')
+
+    def call(self, message: dict) -> dict:
+        self.file.write((json.dumps(message) + '\n').encode())
+        self.file.flush()
+        return json.loads(self.file.readline())
+
+    def brain(self, reversi: Reversi, who: int) -> Coordinate:
+        # assert reversi.next == who
+        reply = self.call({'black': reversi.bitboards[1], 'white': reversi.bitboards[2], 'next': reversi.next})
+        if 'error' in reply:
+            raise Exception('Move server error: {}'.format(reply['error']))
+        y, x = reply['move']
+        return (y, x)
+
+    def stats(self) -> dict:
+        return self.call({'stats': True})
+
+    def close(self):
+        self.file.close()
+        self.sock.close()
+
+if __name__ == '__main__':
+    net = loadNet(MODEL_PATH) # ActorCritic 或蒸馏得到的 Student
+    server = MoveServer(net)
+    print('Serving {} on {}'.format(MODEL_PATH, ADDRESS))
+    server.serve()
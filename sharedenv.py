@@ -0,0 +1,121 @@
+from typing import Iterable, Optional, Tuple
+
+import os
+import torch
+import torch.multiprocessing as mp
+from multiprocessing.connection import Connection
+from reversi import Reversi, Coordinate, SIZE
+from replycache import reply # Minimax 对手（经过应对缓存）
+from env import act
+from vecenv import VecEnvs, toSigned
+import instrument
+
+# 常驻进程环境：每个进程在整个训练过程中持有固定的一组棋盘，每一步只接收动作编号
+# 进程把走完后的位棋盘、reward 和是否结束直接写入共享内存，训练进程不经过序列化直接读取
+# 状态张量和可下棋位置由训练进程从共享的位棋盘批量展开（见 VecEnvs.states 和 VecEnvs.legal）
+
+# 把棋盘写入共享内存的第 i 项
+def writeBoard(buffers: Tuple[torch.Tensor, ...], i: int, reversi: Reversi):
+    black, white, next, end, _, _ = buffers
+    black[i] = toSigned(reversi.bitboards[1])
+    white[i] = toSigned(reversi.bitboards[2])
+    next[i] = reversi.next
+    end[i] = reversi.next == 0
+
+# 常驻进程的主循环，boards 为该进程负责的棋盘编号，编号不小于 half 的棋盘由智能体执白
+def rolloutWorker(conn: Connection, boards: range, half: int, buffers: Tuple[torch.Tensor, ...]):
+    _, _, _, end, actions, rewards = buffers
+    reversis = {}
+
+    while True:
+        command, arg = conn.recv()
+
+        if command == 'reset':
+            opening: Coordinate = arg # 执白的棋盘上 Minimax 的第一步
+            for i in boards:
+                reversi = Reversi()
+                if i >= half:
+                    reversi.place(opening, 1)
+                reversis[i] = reversi
+                writeBoard(buffers, i, reversi)
+                rewards[i] = 0.
+
+        elif command == 'step':
+            for i in boards:
+                if end[i]:
+                    continue
+                a = actions[i].item()
+                _, reward = act(reversis[i], (a // SIZE, a % SIZE))
+                writeBoard(buffers, i, reversis[i])
+                rewards[i] = reward
+
+        elif command == 'close':
+            break
+
+        conn.send(instrument.take()) # 该进程的统计，关闭时为 None
+
+class SharedEnvs(VecEnvs):
+    # 接口与 VecEnvs 相同，num_processes 为常驻进程数，默认为 CPU 核数
+    def __init__(self, num_workers: int, gamma: float, num_processes: Optional[int] = None):
+        super(SharedEnvs, self).__init__(num_workers, gamma, 0)
+
+        # 共享内存缓冲区：黑棋、白棋、轮到谁、是否结束由进程写入，动作由训练进程写入
+        self.black.share_memory_()
+        self.white.share_memory_()
+        self.next.share_memory_()
+        self.end.share_memory_()
+        self.actions = torch.zeros(num_workers, dtype=torch.int64).share_memory_()
+        self.rewards = torch.zeros(num_workers).share_memory_()
+        buffers = (self.black, self.white, self.next, self.end, self.actions, self.rewards)
+
+        num_processes = min(num_processes or os.cpu_count() or 1, num_workers)
+        self.conns = []
+        self.processes = []
+        for k in range(num_processes):
+            boards = range(num_workers * k // num_processes, num_workers * (k + 1) // num_processes)
+            parent, child = mp.Pipe()
+            process = mp.Process(target=rolloutWorker, args=(child, boards, num_workers // 2, buffers), daemon=True)
+            process.start()
+            self.conns.append(parent)
+            self.processes.append(process)
+
+    # 向所有进程发送命令并等待完成，合并各进程发回的统计
+    def broadcast(self, command: str, arg: object = None):
+        for conn in self.conns:
+            conn.send((command, arg))
+        for conn in self.conns:
+            instrument.merge(conn.recv())
+
+    # 重置所有棋盘
+    def reset(self) -> torch.Tensor: # (num_worker, 3, SIZE, SIZE)
+        white = Reversi()
+        self.broadcast('reset', reply(white, 1))
+        self.steps = []
+        self.returns = None
+        return self.states()
+
+    # 让所有棋盘都走一步，输入：动作编号列表
+    # 返回值：第一个值表示所有环境是否结束，第二个是next_state (num_worker, 3, SIZE, SIZE)
+    def step(self, actions_in_int: Iterable[int]) -> Tuple[bool, torch.Tensor]:
+        actions = torch.as_tensor(actions_in_int, dtype=torch.int64).view(-1)
+        active = ~self.end
+        s = self.states()
+
+        self.actions.copy_(actions)
+        self.broadcast('step')
+
+        sn = self.states()
+        self.steps.append((s, actions, self.rewards.clone(), sn, self.end.clone(), active))
+
+        return bool(self.end.all()), torch.where(active.view(-1, 1, 1, 1), sn, torch.zeros_like(sn))
+
+    # 棋盘由常驻进程持有，不支持连续采样
+    def advance(self, actions_in_int: Iterable[int]) -> torch.Tensor:
+        raise Exception('Continuous rollouts need VecEnvs')
+
+    # 结束所有常驻进程
+    def close(self):
+        for conn in self.conns:
+            conn.send(('close', None))
+        for process in self.processes:
+            process.join()
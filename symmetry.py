@@ -0,0 +1,26 @@
+from typing import List
+
+from reversi import SIZE
+
+# 棋盘的 8 种对称变换（二面体群）：先逆时针旋转 k % 4 次 90 度，k >= 4 时再左右翻转
+# 与 torch.flip(torch.rot90(x, k % 4, dims=(-2, -1)), dims=(-1,)) 的结果一致
+SYMMETRIES = 8
+
+# 变换后的第 (y, x) 格来自变换前的哪一格
+def makeSources(k: int) -> List[int]:
+    sources = []
+    for y in range(SIZE):
+        for x in range(SIZE):
+            yy, xx = y, (SIZE - 1 - x if k >= 4 else x)
+            for _ in range(k % 4):
+                yy, xx = xx, SIZE - 1 - yy # 逆时针旋转 90 度的逆映射
+            sources.append(yy * SIZE + xx)
+    return sources
+
+# SOURCES[k][i]：变换 k 后第 i 格来自变换前的哪一格
+SOURCES = [makeSources(k) for k in range(SYMMETRIES)]
+# TARGETS[k][i]：变换前第 i 格在变换 k 后的位置，也就是动作编号的映射表
+TARGETS = [[0] * (SIZE * SIZE) for _ in range(SYMMETRIES)]
+for k in range(SYMMETRIES):
+    for i, source in enumerate(SOURCES[k]):
+        TARGETS[k][source] = i
@@ -0,0 +1,186 @@
+from typing import Callable, Dict, List, Optional, Tuple
+
+from multiprocessing import Pool
+import math
+import os
+import random
+import sys
+import time
+from reversi import Coordinate, Reversi, SIZE
+from evaluation import play, randomAgent
+
+# 锦标赛：任意多个棋手两两对局（循环赛），对局分配到进程池中并行进行
+# 棋手用字符串描述：
+#   'random'                 随机走棋
+#   'minimax' / 'minimax:6'  Minimax，冒号后为搜索深度（与网络棋手一样不查开局库、不做终局求解）
+#   'models/3.pt'            神经网络检查点（只用网络，不查开局库、不做终局求解）
+#   'mcts:models/3.pt'       用该检查点做蒙特卡洛树搜索（见 mcts.py）
+#   'compiled:models/3.pt'   该检查点量化并冻结后的模型（见 inference.py）
+#   'models/'                目录下的所有检查点
+# 每对棋手下 GAMES 局，每个随机开局各执黑、执白一次，开局先随机走 OPENING 步，避免确定性的棋手反复下同一盘棋
+
+GAMES = 100 # 每对棋手的对局数
+OPENING = 4 # 开局随机走的步数
+Z = 1.96 # 95% 置信区间
+
+Player = Callable[[Reversi, int], Coordinate]
+
+players: Dict[str, Player] = {} # 每个进程各自创建的棋手
+
+def makePlayer(spec: str) -> Player:
+    if spec == 'random':
+        return randomAgent
+    elif spec == 'minimax' or spec.startswith('minimax:'):
+        from minimax import Agent as Minimax, DEPTH
+        depth = int(spec.split(':')[1]) if ':' in spec else DEPTH
+        return lambda reversi, who: Minimax.brain(reversi, who, endgame=None, book=None, depth=depth)
+    elif spec.startswith('mcts:'):
+        import torch
+        from mcts import MCTSAgent
+        torch.set_num_threads(1)
+        return MCTSAgent(endgame=None, book=None, path=spec[len('mcts:'):]).brain
+    elif spec.startswith('compiled:'):
+        import torch
+        from agent import Agent
+        torch.set_num_threads(1)
+        return Agent(endgame=None, book=None, path=spec[len('compiled:'):], backend='compiled').brain
+    elif spec.endswith('.pt'):
+        import torch
+        from agent import Agent
+        torch.set_num_threads(1) # 每个进程一个线程，并行度由进程数决定
+        return Agent(endgame=None, book=None, path=spec).brain
+    raise Exception('Unknown player: {}'.format(spec))
+
+def getPlayer(spec: str) -> Player:
+    if spec not in players:
+        players[spec] = makePlayer(spec)
+    return players[spec]
+
+# 把目录展开为其中的检查点，按编号排序
+def expandSpecs(specs: List[str]) -> List[str]:
+    expanded = []
+    for spec in specs:
+        if os.path.isdir(spec):
+            names = [name for name in os.listdir(spec) if name.endswith('.pt')]
+            names.sort(key=lambda name: (not name[:-3].isdigit(), int(name[:-3]) if name[:-3].isdigit() else 0, name))
+            expanded += [os.path.join(spec, name) for name in names]
+        else:
+            expanded.append(spec)
+    return expanded
+
+# 进程池中下一局棋，输入：(黑方, 白方, 随机种子, 开局随机步数)；输出：(胜方, 步数, 用时)
+def playGame(arg: Tuple[str, str, int, int]) -> Tuple[int, int, float]:
+    black, white, seed, opening = arg
+    rnd = random.Random(seed)
+    random.seed(seed) # 随机棋手使用全局的 random
+    reversi = Reversi()
+    for _ in range(opening):
+        moves = reversi.moves
+        squares = [square for square in range(SIZE * SIZE) if moves >> square & 1]
+        reversi.place(divmod(rnd.choice(squares), SIZE), reversi.next)
+
+    player1, player2 = getPlayer(black), getPlayer(white)
+    t = time.perf_counter()
+    winner = play(reversi, player1, player2)
+    return winner, len(reversi.history) - opening, time.perf_counter() - t
+
+# 得分率的 Wilson 置信区间，得分率为 0 或 1 时区间也不会缩成一点
+def wilson(score: float, n: int, z: float = Z) -> Tuple[float, float]:
+    center = (score + z * z / (2 * n)) / (1 + z * z / n)
+    margin = z * math.sqrt(score * (1 - score) / n + z * z / (4 * n * n)) / (1 + z * z / n)
+    return max(center - margin, 0.), min(center + margin, 1.)
+
+# 由胜率计算等级分差，胜率为 0 或 1 时截断
+def eloDifference(score: float) -> float:
+    score = min(max(score, 1e-3), 1 - 1e-3)
+    return -400 * math.log10(1 / score - 1)
+
+# 由所有对局的得分拟合 Elo 等级分（最大似然），第一个棋手固定为 0
+# 每对棋手额外计入一局和棋，避免全胜或全负时等级分发散
+def fitElo(n: int, scores: Dict[Tuple[int, int], List[float]], iterations: int = 200) -> List[float]:
+    ratings = [0.] * n
+    games = {pair: len(s) + 1 for pair, s in scores.items()}
+    points = {pair: sum(s) + 0.5 for pair, s in scores.items()}
+    for _ in range(iterations):
+        for i in range(n):
+            actual = expected = variance = 0.
+            for (a, b), count in games.items():
+                if i not in (a, b):
+                    continue
+                j = b if i == a else a
+                p = 1 / (1 + 10 ** ((ratings[j] - ratings[i]) / 400))
+                actual += points[(a, b)] if i == a else count - points[(a, b)]
+                expected += count * p
+                variance += count * p * (1 - p)
+            if variance > 0:
+                ratings[i] += (actual - expected) / variance * 400 / math.log(10)
+        ratings = [r - ratings[0] for r in ratings]
+    return ratings
+
+# 循环赛，返回每对棋手的结果、Elo 和吞吐量
+def roundRobin(specs: List[str], games: int = GAMES, opening: int = OPENING, num_processes: Optional[int] = None) -> dict:
+    specs = expandSpecs(specs)
+    pairs = [(i, j) for i in range(len(specs)) for j in range(i + 1, len(specs))]
+    tasks = []
+    for i, j in pairs:
+        for g in range(games):
+            # 同一个开局双方各执黑一次
+            black, white = (i, j) if g % 2 == 0 else (j, i)
+            tasks.append((i, j, black, white, g // 2))
+
+    scores: Dict[Tuple[int, int], List[float]] = {pair: [] for pair in pairs} # 前一个棋手每局的得分
+    moves = 0
+    t = time.perf_counter()
+    with Pool(num_processes) as pool:
+        args = [(specs[black], specs[white], seed, opening) for _, _, black, white, seed in tasks]
+        for (i, j, black, white, _), (winner, n, _) in zip(tasks, pool.imap(playGame, args, chunksize=4)):
+            if winner == 0:
+                score = 0.5
+            else:
+                score = 1. if (winner == 1) == (black == i) else 0.
+            scores[(i, j)].append(score)
+            moves += n
+    elapsed = time.perf_counter() - t
+
+    matches = []
+    for (i, j), s in scores.items():
+        n = len(s)
+        mean = sum(s) / n
+        low, high = wilson(mean, n)
+        matches.append({
+            'players': [specs[i], specs[j]],
+            'games': n,
+            'wins': s.count(1.),
+            'draws': s.count(0.5),
+            'losses': s.count(0.),
+            'score': mean,
+            'interval': [low, high],
+            'elo': eloDifference(mean),
+            'elo_interval': [eloDifference(low), eloDifference(high)],
+        })
+
+    return {
+        'players': specs,
+        'matches': matches,
+        'elo': dict(zip(specs, fitElo(len(specs), scores))),
+        'games': len(tasks),
+        'moves': moves,
+        'seconds': elapsed,
+        'games_per_second': len(tasks) / elapsed,
+        'moves_per_second': moves / elapsed,
+    }
+
+def report(result: dict):
+    for match in result['matches']:
+        print('{} vs {}: +{} ={} -{}, score {:.1%} [{:.1%}, {:.1%}], Elo {:+.0f} [{:+.0f}, {:+.0f}]'.format(
+            *match['players'], match['wins'], match['draws'], match['losses'],
+            match['score'], *match['interval'], match['elo'], *match['elo_interval']))
+    print('Elo:')
+    for spec, rating in sorted(result['elo'].items(), key=lambda item: -item[1]):
+        print('{:>10.0f}  {}'.format(rating, spec))
+    print('{} games, {} moves in {:g} seconds, {:.2f} games/s, {:.1f} moves/s'.format(
+        result['games'], result['moves'], result['seconds'], result['games_per_second'], result['moves_per_second']))
+
+if __name__ == '__main__':
+    # 用法：python tournament.py random minimax:2 models/
+    report(roundRobin(sys.argv[1:] or ['models/good.pt', 'random']))
@@ -0,0 +1,271 @@
+from typing import Iterable, List, Optional, Tuple
+
+from multiprocessing import Pool
+import torch
+from reversi import Reversi, SIZE, FULL, LEFT_SHIFTS, RIGHT_SHIFTS
+from replycache import reply # Minimax 对手（经过应对缓存）
+from env import SARSD
+import instrument
+
+# 批量环境：N 个棋盘的黑白棋子各存为一个 int64 张量（每个元素是一个位棋盘），
+# 走法生成、翻转、奖励和状态编码都对整批棋盘做张量运算，不再逐个棋盘序列化到进程池
+# 只有 Minimax 对手的搜索仍然逐个棋盘进行，进程池只传递三个整数并返回一个动作
+
+# 把 64 位无符号整数转换为 int64 能表示的有符号整数（位模式不变）
+def toSigned(bits: int) -> int:
+    return bits - (1 << 64) if bits >> (SIZE * SIZE - 1) else bits
+
+# 把 int64 转换回 64 位无符号整数
+def toUnsigned(bits: int) -> int:
+    return bits & FULL
+
+# int64 的右移是算术右移，高位会补符号位，因此右移方向的掩码还要去掉最高的 d 位
+TENSOR_LEFT_SHIFTS = [(d, toSigned(mask)) for d, mask in LEFT_SHIFTS]
+TENSOR_RIGHT_SHIFTS = [(d, toSigned(mask & (FULL >> d))) for d, mask in RIGHT_SHIFTS]
+BIT_INDEX = torch.arange(SIZE * SIZE)
+
+# 批量计算可以下棋的位置，与 reversi.getMoves 相同
+def batchMoves(own: torch.Tensor, opp: torch.Tensor) -> torch.Tensor:
+    empty = ~(own | opp)
+    moves = torch.zeros_like(own)
+    for d, mask in TENSOR_LEFT_SHIFTS:
+        m = opp & mask
+        t = (own << d) & m
+        for _ in range(SIZE - 3):
+            t |= (t << d) & m
+        moves |= (t << d) & mask & empty
+    for d, mask in TENSOR_RIGHT_SHIFTS:
+        m = opp & mask
+        t = (own >> d) & m
+        for _ in range(SIZE - 3):
+            t |= (t >> d) & m
+        moves |= (t >> d) & mask & empty
+    return moves
+
+# 批量计算在 move 位置下棋后被翻转的棋子，move 为 0 的棋盘没有翻转
+def batchFlips(own: torch.Tensor, opp: torch.Tensor, move: torch.Tensor) -> torch.Tensor:
+    flips = torch.zeros_like(own)
+    for d, mask in TENSOR_LEFT_SHIFTS:
+        m = opp & mask
+        t = (move << d) & m
+        for _ in range(SIZE - 3):
+            t |= (t << d) & m
+        flips |= torch.where(((t << d) & mask & own) != 0, t, 0)
+    for d, mask in TENSOR_RIGHT_SHIFTS:
+        m = opp & mask
+        t = (move >> d) & m
+        for _ in range(SIZE - 3):
+            t |= (t >> d) & m
+        flips |= torch.where(((t >> d) & mask & own) != 0, t, 0)
+    return flips
+
+# 批量统计位棋盘中 1 的个数
+def batchCount(bits: torch.Tensor) -> torch.Tensor:
+    bits = bits - ((bits >> 1) & 0x5555555555555555)
+    bits = (bits & 0x3333333333333333) + ((bits >> 2) & 0x3333333333333333)
+    bits = (bits + (bits >> 4)) & 0x0F0F0F0F0F0F0F0F
+    bits = bits + (bits >> 8)
+    bits = bits + (bits >> 16)
+    bits = bits + (bits >> 32)
+    return bits & 0x7F
+
+# 把位棋盘展开为 (N, SIZE, SIZE) 的 0/1 矩阵
+def batchPlanes(bits: torch.Tensor) -> torch.Tensor:
+    return ((bits.unsqueeze(-1) >> BIT_INDEX) & 1).view(-1, SIZE, SIZE)
+
+# 由位棋盘批量生成状态，格式与 env.getBoardState 相同，给出 out 时直接写入其中
+def batchStates(black: torch.Tensor, white: torch.Tensor, next: torch.Tensor,
+    out: Optional[torch.Tensor] = None) -> torch.Tensor: # (N, 3, SIZE, SIZE)
+
+    if out is None:
+        out = torch.empty(len(black), 3, SIZE, SIZE)
+    out[:, 0].copy_(batchPlanes(black))
+    out[:, 1].copy_(batchPlanes(white))
+    out[:, 2].copy_((2 - next).view(-1, 1, 1).expand(-1, SIZE, SIZE))
+    return out
+
+# 由位棋盘批量生成可下棋位置，(N, SIZE * SIZE) 的 bool 张量，已结束（next 为 0）的棋盘全为 False
+def batchLegal(black: torch.Tensor, white: torch.Tensor, next: torch.Tensor) -> torch.Tensor:
+    blackToMove = next == 1
+    own = torch.where(blackToMove, black, white)
+    opp = torch.where(blackToMove, white, black)
+    moves = torch.where(next == 0, 0, batchMoves(own, opp))
+    return batchPlanes(moves).view(-1, SIZE * SIZE).bool()
+
+# 进程池中运行的 Minimax 对手，输入：(黑棋, 白棋, 轮到谁)；输出：动作编号
+def opponentMove(arg: Tuple[int, int, int]) -> int:
+    black, white, who = arg
+    reversi = Reversi()
+    reversi.load(toUnsigned(black), toUnsigned(white), who)
+    y, x = reply(reversi, who)
+    return y * SIZE + x
+
+# 进程池中使用的版本，同时发回该进程的统计（见 instrument.py）
+def remoteOpponentMove(arg: Tuple[int, int, int]) -> Tuple[int, Optional[dict]]:
+    return opponentMove(arg), instrument.take()
+
+class VecEnvs:
+    # 接口与 env.Envs 相同，num_processes 为 Minimax 对手使用的进程数，0 表示在本进程中搜索
+    def __init__(self, num_workers: int, gamma: float, num_processes: Optional[int] = None):
+        self.num_workers = num_workers
+        self.gamma = gamma
+        self.pool = Pool(num_processes) if num_processes != 0 else None
+
+        self.black = torch.zeros(num_workers, dtype=torch.int64)
+        self.white = torch.zeros(num_workers, dtype=torch.int64)
+        self.next = torch.zeros(num_workers, dtype=torch.int64) # 轮到哪个颜色，0 表示已结束
+        self.end = torch.ones(num_workers, dtype=torch.bool)
+        # 智能体执黑还是执白，前一半棋盘执黑，后一半执白
+        self.agent = torch.tensor([1] * (num_workers // 2) + [2] * (num_workers - num_workers // 2))
+
+        # 每一步整批记录：(state, action, reward, next_state, done, 该步是否有效)
+        self.steps = []
+        self.returns = None
+
+    # 整批棋盘的状态，格式与 env.getBoardState 相同
+    def states(self) -> torch.Tensor: # (num_worker, 3, SIZE, SIZE)
+        return batchStates(self.black, self.white, self.next)
+
+    # 整批棋盘可以下棋的位置，(num_worker, SIZE * SIZE) 的 bool 张量
+    # 已结束的棋盘全为 ended：采样动作时传 True，让这些棋盘的分布仍然合法（动作会被忽略）
+    def legal(self, ended: bool = False) -> torch.Tensor:
+        legal = batchLegal(self.black, self.white, self.next)
+        if ended:
+            legal |= self.end.view(-1, 1)
+        return legal
+
+    # 每个棋盘的初始局面 (num_worker, 3)：黑棋、白棋、轮到谁，智能体执白的棋盘上 Minimax 已经走了第一步
+    def openings(self) -> torch.Tensor:
+        black = Reversi()
+        white = Reversi()
+        white.place(reply(white, 1), 1)
+
+        boards = torch.tensor([[toSigned(r.bitboards[1]), toSigned(r.bitboards[2]), r.next]
+            for r in (black, white)], dtype=torch.int64)
+        return boards[self.agent - 1]
+
+    # 重置所有棋盘
+    def reset(self) -> torch.Tensor: # (num_worker, 3, SIZE, SIZE)
+        boards = self.openings()
+        self.black, self.white, self.next = boards[:, 0].clone(), boards[:, 1].clone(), boards[:, 2].clone()
+        self.end = torch.zeros(self.num_workers, dtype=torch.bool)
+        self.steps = []
+        self.returns = None
+        return self.states()
+
+    # 只重置 mask 为 True 的棋盘
+    def restart(self, mask: torch.Tensor):
+        boards = self.openings()
+        self.black = torch.where(mask, boards[:, 0], self.black)
+        self.white = torch.where(mask, boards[:, 1], self.white)
+        self.next = torch.where(mask, boards[:, 2], self.next)
+        self.end = self.next == 0
+
+    # 在 active 为 True 的棋盘上走 actions 指定的一步，并更新轮到哪一方下棋
+    def play(self, actions: torch.Tensor, active: torch.Tensor):
+        move = torch.where(active, torch.ones_like(actions) << actions, 0)
+        blackToMove = self.next == 1
+        own = torch.where(blackToMove, self.black, self.white)
+        opp = torch.where(blackToMove, self.white, self.black)
+
+        legal = batchMoves(own, opp)
+        if ((move & legal) != move).any():
+            raise Exception('Should not reach here!')
+
+        flips = batchFlips(own, opp, move)
+        own = own | move | flips
+        opp = opp ^ flips
+        self.black = torch.where(blackToMove, own, opp)
+        self.white = torch.where(blackToMove, opp, own)
+
+        # 对方有位置下则轮到对方，否则己方继续，双方都没有位置下则对局结束
+        other = 3 - self.next
+        oppMovable = batchMoves(opp, own) != 0
+        ownMovable = batchMoves(own, opp) != 0
+        next = torch.where(oppMovable, other, torch.where(ownMovable, self.next, 0))
+        self.next = torch.where(active, next, self.next)
+        self.end = self.next == 0
+
+    # 在 active 的棋盘上走一步，Minimax 应对，返回智能体的 reward
+    def transition(self, actions: torch.Tensor, active: torch.Tensor) -> torch.Tensor:
+        self.play(actions, active)
+
+        # Minimax 走棋，直到轮到智能体或对局结束
+        opponent = 3 - self.agent
+        with instrument.timer('env.opponent'):
+            while True:
+                waiting = (self.next == opponent) & ~self.end
+                if not waiting.any():
+                    break
+                idx = waiting.nonzero().view(-1)
+                args = list(zip(self.black[idx].tolist(), self.white[idx].tolist(), self.next[idx].tolist()))
+                if self.pool is not None:
+                    replies = []
+                    for action, snapshot in self.pool.map(remoteOpponentMove, args):
+                        replies.append(action)
+                        instrument.merge(snapshot)
+                else:
+                    replies = list(map(opponentMove, args))
+                moves = torch.zeros(self.num_workers, dtype=torch.int64)
+                moves[idx] = torch.tensor(replies, dtype=torch.int64)
+                self.play(moves, waiting)
+
+        # 计算reward：结束时胜利 100、失败 -100、平局 0，未结束时棋子多 1、少 -1、相同 0
+        agentCount = batchCount(torch.where(self.agent == 1, self.black, self.white))
+        opponentCount = batchCount(torch.where(self.agent == 1, self.white, self.black))
+        lead = torch.sign(agentCount - opponentCount)
+        return torch.where(self.end, lead * 100, lead).float()
+
+    # 让所有棋盘都走一步，输入：动作编号列表
+    # 返回值：第一个值表示所有环境是否结束，第二个是next_state (num_worker, 3, SIZE, SIZE)
+    def step(self, actions_in_int: Iterable[int]) -> Tuple[bool, torch.Tensor]:
+        actions = torch.as_tensor(actions_in_int, dtype=torch.int64).view(-1)
+        active = ~self.end
+        s = self.states()
+
+        reward = self.transition(actions, active)
+
+        sn = self.states()
+        self.steps.append((s, actions, reward, sn, self.end.clone(), active))
+
+        return bool(self.end.all()), torch.where(active.view(-1, 1, 1, 1), sn, torch.zeros_like(sn))
+
+    # 连续采样：所有棋盘都走一步，对局结束的棋盘立即各自重新开局，不等待其他棋盘
+    # 记录中的 done 标出每个棋盘的对局边界，返回重新开局后的状态 (num_worker, 3, SIZE, SIZE)
+    def advance(self, actions_in_int: Iterable[int]) -> torch.Tensor:
+        actions = torch.as_tensor(actions_in_int, dtype=torch.int64).view(-1)
+        active = torch.ones(self.num_workers, dtype=torch.bool)
+        s = self.states()
+
+        reward = self.transition(actions, active)
+
+        done = self.end.clone()
+        self.steps.append((s, actions, reward, self.states(), done, active))
+        if done.any():
+            self.restart(done)
+        return self.states()
+
+    # 开始新的一段连续采样，棋盘保持原样
+    def segment(self):
+        self.steps = []
+        self.returns = None
+
+    # 从后向前整批更新Return，对局在 done 处截断
+    # 连续采样时片段末尾的对局还没有结束，bootstrap 给出最后状态的估值（通常来自 critic）
+    def setReturn(self, bootstrap: Optional[torch.Tensor] = None):
+        R = torch.zeros(self.num_workers) if bootstrap is None else bootstrap.view(-1).float()
+        self.returns = []
+        for _, _, reward, _, done, active in reversed(self.steps):
+            R = torch.where(active, reward + self.gamma * torch.where(done, 0., R), 0.)
+            self.returns.append(R)
+        self.returns.reverse()
+
+    # 取得合并后的history，顺序与 env.Envs 相同：先按棋盘，再按时间
+    def readHistory(self) -> List[SARSD]:
+        history_all = []
+        for i in range(self.num_workers):
+            for (s, actions, _, sn, done, active), R in zip(self.steps, self.returns):
+                if active[i]:
+                    a = actions[i].item()
+                    history_all.append([s[i], (a // SIZE, a % SIZE), R[i].item(), sn[i], done[i].item()])
+        return history_all